@@ -1,16 +1,21 @@
 from flask import Flask, render_template, request, jsonify
-import requests
 import os
 import datetime
 import re
+from concurrent.futures import ThreadPoolExecutor
+import youtube_client
+import thumbnail_store
 
 app = Flask(__name__)
 
 # Ensure download directory exists
-DOWNLOAD_FOLDER = 'downloaded_thumbnails'
+DOWNLOAD_FOLDER = thumbnail_store.DOWNLOAD_FOLDER
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER)
 
+# Thumbnails downloaded at the same time by /api/save_thumbnails
+THUMBNAIL_WORKERS = 4
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -23,6 +28,57 @@ def extract_video_id(url):
         return match.group(1)
     return None
 
+def video_result(item, url):
+    """Message parts for one videos.list item, as returned by /api/process."""
+    snippet = item['snippet']
+    live_details = item.get('liveStreamingDetails')
+
+    title = snippet['title']
+
+    # Thumbnail: Try maxres, then standard, then high, then medium, then default
+    thumbnails = snippet['thumbnails']
+    thumbnail_url = (thumbnails.get('maxres') or 
+                     thumbnails.get('standard') or 
+                     thumbnails.get('high') or 
+                     thumbnails.get('medium') or 
+                     thumbnails.get('default'))['url']
+
+    # Date handling
+    if live_details and 'scheduledStartTime' in live_details:
+        # Live stream scheduled
+        dt_str = live_details['scheduledStartTime']
+        # ISO 8601 format: 2023-11-28T15:00:00Z
+        # We need to handle timezone. Assuming input is UTC, convert to JST (+9)
+        dt = datetime.datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+        dt = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
+    elif live_details and 'actualStartTime' in live_details:
+         # Live stream started
+        dt_str = live_details['actualStartTime']
+        dt = datetime.datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+        dt = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
+    else:
+        # Regular video upload date
+        dt_str = snippet['publishedAt']
+        dt = datetime.datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+        dt = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
+
+    # Format: MM月DD日(曜日) HH時MM分～
+    weekdays = ["月", "火", "水", "木", "金", "土", "日"]
+    weekday_str = weekdays[dt.weekday()]
+    formatted_date = dt.strftime(f'%m月%d日({weekday_str}) %H時%M分～')
+    file_date = dt.strftime('%Y%m%d')
+    
+    message = f"```python\n'{title}'\n```\n### {formatted_date}\n<{url}>"
+    
+    return {
+        'thumbnail_url': thumbnail_url,
+        'message': message,
+        'video_id': item['id'],
+        'title': title,
+        'file_date': file_date,
+        'formatted_date': formatted_date
+    }
+
 @app.route('/api/process', methods=['POST'])
 def process_url():
     data = request.json
@@ -39,76 +95,56 @@ def process_url():
         return jsonify({'error': 'Invalid YouTube URL'}), 400
 
     try:
-        # YouTube Data API v3
-        api_url = "https://www.googleapis.com/youtube/v3/videos"
-        params = {
-            'part': 'snippet,liveStreamingDetails',
-            'id': video_id,
-            'key': api_key
-        }
-        
-        response = requests.get(api_url, params=params)
-        if response.status_code != 200:
-            return jsonify({'error': f'YouTube API Error: {response.status_code}'}), 500
-            
-        result = response.json()
-        if not result['items']:
+        # Cached metadata is reused, so regenerating the same video does not use API quota
+        item = youtube_client.get_video(video_id, api_key)
+        if item is None:
             return jsonify({'error': 'Video not found'}), 404
-            
-        item = result['items'][0]
-        snippet = item['snippet']
-        live_details = item.get('liveStreamingDetails')
-        
-        title = snippet['title']
-        
-        # Thumbnail: Try maxres, then standard, then high, then medium, then default
-        thumbnails = snippet['thumbnails']
-        thumbnail_url = (thumbnails.get('maxres') or 
-                         thumbnails.get('standard') or 
-                         thumbnails.get('high') or 
-                         thumbnails.get('medium') or 
-                         thumbnails.get('default'))['url']
-
-        # Date handling
-        if live_details and 'scheduledStartTime' in live_details:
-            # Live stream scheduled
-            dt_str = live_details['scheduledStartTime']
-            # ISO 8601 format: 2023-11-28T15:00:00Z
-            # We need to handle timezone. Assuming input is UTC, convert to JST (+9)
-            dt = datetime.datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            dt = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
-        elif live_details and 'actualStartTime' in live_details:
-             # Live stream started
-            dt_str = live_details['actualStartTime']
-            dt = datetime.datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            dt = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
-        else:
-            # Regular video upload date
-            dt_str = snippet['publishedAt']
-            dt = datetime.datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            dt = dt.astimezone(datetime.timezone(datetime.timedelta(hours=9)))
-
-        # Format: MM月DD日(曜日) HH時MM分～
-        weekdays = ["月", "火", "水", "木", "金", "土", "日"]
-        weekday_str = weekdays[dt.weekday()]
-        formatted_date = dt.strftime(f'%m月%d日({weekday_str}) %H時%M分～')
-        file_date = dt.strftime('%Y%m%d')
-        
-        message = f"```python\n'{title}'\n```\n### {formatted_date}\n<{url}>"
-        
-        return jsonify({
-            'thumbnail_url': thumbnail_url,
-            'message': message,
-            'video_id': video_id,
-            'title': title,
-            'file_date': file_date,
-            'formatted_date': formatted_date
-        })
+        return jsonify(video_result(item, url))
+
+    except youtube_client.YouTubeAPIError as e:
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/process_batch', methods=['POST'])
+def process_batch():
+    """Like /api/process for a list of URLs, resolved with one API call per 50 videos."""
+    data = request.json
+    urls = data.get('urls') or []
+    api_key = data.get('apiKey')
 
+    if not urls:
+        return jsonify({'error': 'URLs are required'}), 400
+    if len(urls) > youtube_client.MAX_IDS_PER_CALL:
+        return jsonify({'error': f'At most {youtube_client.MAX_IDS_PER_CALL} URLs at a time'}), 400
+    if not api_key:
+        return jsonify({'error': 'API Key is required'}), 400
+
+    video_ids = [extract_video_id(url) for url in urls]
+    try:
+        items = youtube_client.get_videos([v for v in video_ids if v], api_key)
+    except youtube_client.YouTubeAPIError as e:
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+    results = []
+    for url, video_id in zip(urls, video_ids):
+        if not video_id:
+            results.append({'url': url, 'error': 'Invalid YouTube URL'})
+        elif video_id not in items:
+            results.append({'url': url, 'error': 'Video not found'})
+        else:
+            results.append(dict(video_result(items[video_id], url), url=url))
+    return jsonify({'results': results})
+
+def thumbnail_path(title, file_date):
+    # Sanitize title for filename
+    safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
+    return os.path.join(DOWNLOAD_FOLDER, f"{file_date}_{safe_title}.jpg")
+
 @app.route('/api/save_thumbnail', methods=['POST'])
 def save_thumbnail():
     data = request.json
@@ -120,20 +156,50 @@ def save_thumbnail():
         return jsonify({'error': 'Missing data'}), 400
         
     try:
-        response = requests.get(thumbnail_url)
-        if response.status_code == 200:
-            # Sanitize title for filename
-            safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
-            filename = f"{file_date}_{safe_title}.jpg"
-            filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            return jsonify({'message': 'Thumbnail saved', 'path': filepath})
-        else:
-            return jsonify({'error': 'Failed to download image'}), 500
+        # Already saved thumbnails are reused instead of downloaded again
+        filepath = thumbnail_path(title, file_date)
+        downloaded = thumbnail_store.save(thumbnail_url, filepath, data.get('videoId'))
+        return jsonify({'message': 'Thumbnail saved', 'path': filepath, 'downloaded': downloaded})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/save_thumbnails', methods=['POST'])
+def save_thumbnails():
+    """Saves the thumbnails of up to 50 videos (URLs), THUMBNAIL_WORKERS at a time."""
+    data = request.json
+    urls = data.get('urls') or []
+    api_key = data.get('apiKey')
+
+    if not urls:
+        return jsonify({'error': 'URLs are required'}), 400
+    if len(urls) > youtube_client.MAX_IDS_PER_CALL:
+        return jsonify({'error': f'At most {youtube_client.MAX_IDS_PER_CALL} URLs at a time'}), 400
+    if not api_key:
+        return jsonify({'error': 'API Key is required'}), 400
+
+    video_ids = [extract_video_id(url) for url in urls]
+    try:
+        items = youtube_client.get_videos([v for v in video_ids if v], api_key)
     except Exception as e:
+        print(f"Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+    def save_one(url, video_id):
+        if not video_id:
+            return {'url': url, 'error': 'Invalid YouTube URL'}
+        if video_id not in items:
+            return {'url': url, 'error': 'Video not found'}
+        video = video_result(items[video_id], url)
+        filepath = thumbnail_path(video['title'], video['file_date'])
+        try:
+            downloaded = thumbnail_store.save(video['thumbnail_url'], filepath, video_id)
+        except Exception as e:
+            return {'url': url, 'error': str(e)}
+        return {'url': url, 'path': filepath, 'downloaded': downloaded}
+
+    with ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS) as pool:
+        results = list(pool.map(save_one, urls, video_ids))
+    return jsonify({'results': results})
+
 if __name__ == '__main__':
     app.run(debug=True)
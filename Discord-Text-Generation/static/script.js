@@ -133,6 +133,7 @@ document.getElementById('saveThumbnailBtn').addEventListener('click', async () =
             },
             body: JSON.stringify({
                 thumbnailUrl: currentThumbnailUrl,
+                videoId: currentVideoId,
                 title: currentTitle,
                 fileDate: currentFileDate
             })
@@ -0,0 +1,128 @@
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+import youtube_client
+
+# Saved thumbnails keep their readable names (YYYYMMDD_title.jpg) in
+# DOWNLOAD_FOLDER. Each one is a hard link to a file in STORE_FOLDER named
+# after the SHA-256 of its contents, so identical images are stored once.
+DOWNLOAD_FOLDER = 'downloaded_thumbnails'
+STORE_FOLDER = os.path.join(DOWNLOAD_FOLDER, '.store')
+INDEX_FILE = os.path.join(STORE_FOLDER, 'index.db')
+
+# A thumbnail saved less than this many seconds ago is reused without
+# asking the server; after that a conditional request (ETag /
+# Last-Modified) checks whether it changed.
+REVALIDATE_SECONDS = 24 * 60 * 60
+
+# Download chunk size.
+CHUNK_SIZE = 64 * 1024
+
+# Seconds before a download gives up.
+TIMEOUT = 20
+
+def _connect():
+    os.makedirs(STORE_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(INDEX_FILE, timeout=10)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS thumbnails (
+        url TEXT PRIMARY KEY,
+        video_id TEXT,
+        sha256 TEXT NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        checked_at REAL NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS thumbnails_video ON thumbnails (video_id)')
+    return conn
+
+def blob_path(sha256):
+    return os.path.join(STORE_FOLDER, sha256[:2], sha256 + '.jpg')
+
+def _download(url, headers):
+    """
+    Streams url into a temp file in the store, hashing it on the way.
+
+    Returns (response, temp path, sha256), or (response, None, None) when
+    the server answered 304 Not Modified. Nothing is ever written to a
+    final path here, so an interrupted download leaves no partial image.
+    """
+    response = youtube_client.session().get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    with response:
+        if response.status_code == 304:
+            return response, None, None
+        response.raise_for_status()
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=STORE_FOLDER, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return response, tmp_path, digest.hexdigest()
+
+def _place(source, path):
+    """Atomically makes path a hard link to source (a copy where links are not supported)."""
+    if os.path.exists(path) and os.path.samefile(source, path):
+        return
+    tmp_path = f'{path}.{threading.get_ident()}.part'
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        with open(source, 'rb') as src, open(tmp_path, 'wb') as dst:
+            while chunk := src.read(CHUNK_SIZE):
+                dst.write(chunk)
+    os.replace(tmp_path, path)
+
+def save(url, path, video_id=None):
+    """
+    Saves the image at url to path and returns True if it was downloaded,
+    False if the stored copy was still good.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT sha256, etag, last_modified, checked_at FROM thumbnails WHERE url = ?',
+                           (url,)).fetchone()
+        if row and os.path.exists(blob_path(row[0])):
+            sha256, etag, last_modified, checked_at = row
+            if now - checked_at < REVALIDATE_SECONDS:
+                _place(blob_path(sha256), path)
+                return False
+            headers = {}
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        else:
+            headers = {}
+
+        response, tmp_path, sha256 = _download(url, headers)
+        if tmp_path is None:
+            with conn:
+                conn.execute('UPDATE thumbnails SET checked_at = ? WHERE url = ?', (now, url))
+            _place(blob_path(row[0]), path)
+            return False
+
+        target = blob_path(sha256)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, target)
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?)', (
+                url, video_id, sha256, response.headers.get('ETag'),
+                response.headers.get('Last-Modified'), now))
+        _place(target, path)
+        return True
+    finally:
+        conn.close()
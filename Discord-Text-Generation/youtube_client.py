@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# YouTube Data API v3. Override with YOUTUBE_API_BASE_URL to point the app at
+# a local stub server for testing.
+API_BASE_URL = os.environ.get('YOUTUBE_API_BASE_URL', 'https://www.googleapis.com/youtube/v3')
+
+# videos.list accepts at most this many ids per call.
+MAX_IDS_PER_CALL = 50
+
+# Seconds before an API call gives up.
+TIMEOUT = 10
+
+# Video metadata is cached on disk, keyed by video_id. How long an entry is
+# trusted depends on the video: an upcoming stream may still be rescheduled
+# or retitled, a live one gets its end time soon, a finished video rarely
+# changes. The least recently used entries beyond CACHE_MAX_ENTRIES are
+# dropped.
+CACHE_FILE = 'metadata_cache.db'
+CACHE_MAX_ENTRIES = 2000
+TTL_SECONDS = {
+    'upcoming': 10 * 60,
+    'live': 5 * 60,
+    'none': 7 * 24 * 60 * 60,
+}
+
+class YouTubeAPIError(Exception):
+    """The API answered with an error status."""
+
+    def __init__(self, status_code):
+        super().__init__(f'YouTube API Error: {status_code}')
+        self.status_code = status_code
+
+_session = None
+_session_lock = threading.Lock()
+
+def session():
+    """One pooled HTTP session for the whole app, so connections are reused between requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+            _session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        return _session
+
+def _connect():
+    conn = sqlite3.connect(CACHE_FILE, timeout=10)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS videos (
+        video_id TEXT PRIMARY KEY,
+        item TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS videos_last_used ON videos (last_used)')
+    return conn
+
+def ttl(item):
+    """Seconds a videos.list item stays cached (see TTL_SECONDS)."""
+    state = item.get('snippet', {}).get('liveBroadcastContent', 'none')
+    return TTL_SECONDS.get(state, TTL_SECONDS['none'])
+
+def _cached(conn, video_ids, now):
+    """{video_id: item} of the unexpired cache entries among video_ids, marked as used."""
+    found = {}
+    for video_id, item in conn.execute(
+            f"SELECT video_id, item FROM videos WHERE expires_at > ? AND video_id IN ({','.join('?' * len(video_ids))})",
+            [now] + list(video_ids)):
+        found[video_id] = json.loads(item)
+    conn.executemany('UPDATE videos SET last_used = ? WHERE video_id = ?', [(now, v) for v in found])
+    return found
+
+def _store(conn, items, now):
+    conn.executemany('INSERT OR REPLACE INTO videos (video_id, item, expires_at, last_used) VALUES (?, ?, ?, ?)',
+                     [(item['id'], json.dumps(item), now + ttl(item), now) for item in items])
+    conn.execute('''
+        DELETE FROM videos WHERE video_id IN (
+            SELECT video_id FROM videos ORDER BY last_used DESC LIMIT -1 OFFSET ?)
+    ''', (CACHE_MAX_ENTRIES,))
+
+def fetch_videos(video_ids, api_key):
+    """videos.list items for up to MAX_IDS_PER_CALL ids in one API call, bypassing the cache."""
+    response = session().get(f'{API_BASE_URL}/videos', params={
+        'part': 'snippet,liveStreamingDetails',
+        'id': ','.join(video_ids),
+        'key': api_key,
+    }, timeout=TIMEOUT)
+    if response.status_code != 200:
+        raise YouTubeAPIError(response.status_code)
+    return response.json().get('items', [])
+
+def get_videos(video_ids, api_key):
+    """
+    {video_id: videos.list item} for video_ids, from the cache where it is
+    fresh and otherwise from the API, MAX_IDS_PER_CALL ids per call.
+    Videos that do not exist are missing from the result.
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    if not video_ids:
+        return {}
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            found = _cached(conn, video_ids, now)
+        missing = [v for v in video_ids if v not in found]
+        for i in range(0, len(missing), MAX_IDS_PER_CALL):
+            items = fetch_videos(missing[i:i + MAX_IDS_PER_CALL], api_key)
+            with conn:
+                _store(conn, items, now)
+            found.update((item['id'], item) for item in items)
+    finally:
+        conn.close()
+    return found
+
+def get_video(video_id, api_key):
+    """The videos.list item of one video, None if it does not exist."""
+    return get_videos([video_id], api_key).get(video_id)
@@ -1,10 +1,8 @@
 import streamlit as st
-import sqlite3
-from collections import defaultdict
 import datetime
-
-# データベース設定
-DB_FILE = 'kunue_rii.db'
+import html
+import search_index
+import vector_index
 
 def format_date(date_str):
     """YYYYMMDD -> YYYY年MM月DD日"""
@@ -12,55 +10,174 @@ def format_date(date_str):
         return f"{date_str[:4]}年{date_str[4:6]}月{date_str[6:]}日"
     return date_str
 
-def search_db(query):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+def format_timestamp(start_ms):
+    """ミリ秒 -> HH:MM:SS"""
+    m, s = divmod(start_ms // 1000, 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+def video_url(video_id, start_ms):
+    """その時刻から再生するYouTubeのURL"""
+    return f"https://www.youtube.com/watch?v={video_id}&t={start_ms // 1000}s"
+
+def load_videos():
+    """絞り込み用の動画一覧 [(id, date, title), ...]（新しい順）"""
     try:
-        # 全文検索
-        c.execute('''
-            SELECT date, title, text, timestamp, url 
-            FROM subtitles 
-            WHERE subtitles MATCH ? 
-            LIMIT 200
-        ''', (query,))
-        results = c.fetchall()
+        return search_index.list_videos()
     except Exception as e:
-        st.error(f"検索エラー: {e}")
+        st.error(f"データベースエラー: {e}")
         return []
-    finally:
-        conn.close()
-    return results
 
-def group_results(results):
+def load_tags():
+    """絞り込み用のタイトルのタグ一覧 [(タグ, 動画数), ...]（多い順）"""
+    try:
+        return search_index.list_tags()
+    except Exception:
+        return []
+
+def load_ingest_status():
+    """rebuild_db.py --watch が最後に取り込んだ時刻と、ファイル追加から検索できるまでの秒数"""
+    try:
+        return search_index.ingest_status()
+    except Exception:
+        return None
+
+def search_db(query, filters, order='date', cursor=None, spans=False, limit=search_index.PAGE_SIZE):
     """
-    検索結果を動画（タイトル・日付）ごとにグループ化する
+    全文検索（1ページ分）。filters は date_from / date_to（YYYYMMDD）、video_id、month（YYYYMM）と tag。
+    spans=True なら字幕2行にまたがる言葉も探す。
+    接続と検索結果は search_index 側で使い回すので、同じ検索の再実行はほぼ一瞬で終わる。
     Returns:
-        Dict[str, Dict]: {
-            'date_title_key': {
-                'date': str,
-                'title': str,
-                'matches': List[Dict]
-            }
-        }
+        Tuple[List[Row], cursor]: 結果と、次のページを取るためのカーソル（最後のページなら None）
+    """
+    try:
+        return search_index.search(query, filters, order, cursor, limit, spans)
+    except Exception as e:
+        st.error(f"検索エラー: {e}")
+        return [], None
+
+def load_context(results, size):
+    """ヒットした発言の前後の字幕 {字幕id: (前, 後)}。1ページ分をまとめて1回のクエリで取る"""
+    try:
+        return search_index.context(results, size)
+    except Exception as e:
+        st.error(f"検索エラー: {e}")
+        return {}
+
+def load_facets(query, filters, spans=False):
+    """検索語の正確なヒット数を動画別・月別・タグ別に数える（SQL 側で集計する）"""
+    try:
+        return search_index.facets(query, filters, spans)
+    except Exception:
+        return {'videos': {}, 'months': {}, 'tags': {}}
+
+def load_suggestions(query):
+    """入力中の最後の言葉の続きの候補 [(言葉, 発言数), ...]。取り込み時に数えた件数なので検索はしない"""
+    try:
+        return search_index.suggest(query, SUGGESTIONS)
+    except Exception:
+        return []
+
+def use_suggestion(term):
+    """候補が押されたら、入力中の最後の言葉をその候補に置き換える"""
+    terms = st.session_state.query.split()
+    st.session_state.query = ' '.join(terms[:-1] + [term])
+
+def select_tag(tag):
+    """件数の一覧でタグが押されたら、サイドバーのタグの絞り込みに反映する"""
+    st.session_state.tag = tag
+
+def load_video_hits(query, filters, order, spans=False):
+    """ヒットした動画の一覧 [(video_id, date, title, hits), ...]。発言そのものは読まない"""
+    try:
+        return search_index.video_hits(query, filters, order, spans)
+    except Exception as e:
+        st.error(f"検索エラー: {e}")
+        return []
+
+def count_hits(query, filters, spans=False):
+    """ヒットした (発言数, 動画数)。エラーは search_db 側で表示する"""
+    try:
+        return search_index.count(query, filters, spans)
+    except Exception:
+        return 0, 0
+
+# 並び順の表示名
+ORDER_LABELS = {
+    'date': '新しい順',
+    'relevance': '関連度順',
+    'recent': '関連度（新しさ重視）',
+    'hybrid': '意味の近さも考慮',
+}
+
+# 件数の一覧にボタンとして出すタグの数
+TOP_TAGS = 12
+
+# 検索欄の下に出す言葉の候補の数
+SUGGESTIONS = 4
+
+# 折りたたみ表示で1ページに並べる動画の数と、動画を開いたときに読み込む発言の数
+VIDEOS_PER_PAGE = 20
+MATCHES_PER_VIDEO = 20
+
+def show_facets(facets):
+    """月別の件数のグラフと、件数の多いタグの絞り込みボタン"""
+    with st.expander("📊 月別・タグ別の件数"):
+        months = sorted(facets['months'].items())
+        st.bar_chart({'月': [f"{m[:4]}/{m[4:]}" for m, _ in months],
+                      '件数': [hits for _, (hits, _) in months]}, x='月', y='件数')
+        top_tags = sorted(facets['tags'].items(), key=lambda t: (-t[1][0], t[0]))[:TOP_TAGS]
+        if top_tags:
+            st.caption("タグを押すと、そのタグの動画だけに絞り込みます")
+            tag_cols = st.columns(4)
+            for i, (tag_name, (hits, n_videos)) in enumerate(top_tags):
+                tag_cols[i % 4].button(f"{tag_name}（{n_videos}本・{hits}件）", key=f"facet_tag_{tag_name}",
+                                       on_click=select_tag, args=(tag_name,))
+
+def matches_html(matches, around):
+    """
+    1本の動画の発言をまとめた HTML。発言ごとに st.columns を作らず
+    1回の st.markdown で描くので、件数が多くてもウィジェットは増えない。
+    """
+    parts = []
+    for match in matches:
+        # 単語ごとの時刻があれば、検索語を話した瞬間から再生する
+        url = html.escape(video_url(match['video_id'], match['match_ms']))
+        before, after = around.get(match['id'], ([], []))
+        lines = [f'<a href="{url}" target="_blank">▶️ {format_timestamp(match["match_ms"])}</a>']
+        lines += [f'<div class="match-context">{html.escape(line["text"])}</div>' for line in before]
+        lines.append(f'<div>「{html.escape(match["text"])}」</div>')
+        lines += [f'<div class="match-context">{html.escape(line["text"])}</div>' for line in after]
+        parts.append(f'<div class="match-box">{"".join(lines)}</div>')
+    return ''.join(parts)
+
+def show_more(limit_key):
+    st.session_state[limit_key] = st.session_state.get(limit_key, MATCHES_PER_VIDEO) + MATCHES_PER_VIDEO
+
+def turn_video_page(step):
+    st.session_state.video_page += step
+
+@st.fragment
+def video_matches(video, query, filters, order, spans, context_size):
+    """
+    折りたたみ表示の1本の動画。開いたときに初めてその動画の発言を読み込む。
+    st.fragment なので、開閉や「もっと見る」で再実行されるのはこの動画の部分だけ。
     """
-    grouped = defaultdict(lambda: {'date': '', 'title': '', 'matches': []})
-    
-    # Sort results by date desc first (though we removed ORDER BY in SQL, we can sort here if needed, 
-    # but for grouping we just need to aggregate)
-    # Let's sort by date desc for display order
-    sorted_results = sorted(results, key=lambda x: x[0], reverse=True)
-
-    for date, title, text, timestamp, url in sorted_results:
-        key = f"{date}_{title}"
-        grouped[key]['date'] = date
-        grouped[key]['title'] = title
-        grouped[key]['matches'].append({
-            'text': text,
-            'timestamp': timestamp,
-            'url': url
-        })
-    
-    return grouped
+    video_id = video['video_id']
+    label = f"📅 {format_date(video['date'])}　{video['title']}（{video['hits']}件）"
+    if not st.toggle(label, key=f"open_{video_id}"):
+        return
+    limit_key = f"limit_{video_id}"
+    limit = st.session_state.get(limit_key, MATCHES_PER_VIDEO)
+    results, next_cursor = search_db(query, {**filters, 'video_id': video_id}, order, None, spans, limit)
+    if not results:
+        return
+    matches = search_index.group_results(results, query)[video_id]['matches']
+    around = load_context(results, context_size)
+    st.markdown(matches_html(matches, around), unsafe_allow_html=True)
+    if next_cursor is not None:
+        st.button(f"もっと見る（残り {video['hits'] - len(results)} 件）", key=f"more_{video_id}",
+                  on_click=show_more, args=(limit_key,))
 
 # ページ設定
 st.set_page_config(page_title="薫衣りぃ配信検索", layout="wide")
@@ -102,6 +219,10 @@ st.markdown("""
             margin-bottom: 10px;
             border-left: 5px solid #FF4B4B;
         }
+        .match-context {
+            color: #808495;
+            font-size: 0.875em;
+        }
         .stApp {
             scroll-behavior: smooth;
         }
@@ -112,19 +233,137 @@ st.markdown("""
 st.title("📺 薫衣りぃ db検索")
 st.markdown("キーワードを入力すると、その発言をしたシーンを検索してURLを表示します。")
 st.markdown("※ 複数のキーワードはスペースで区切ってください（例: `原神 スターレイル`）")
+st.markdown("※ 1〜2文字の言葉（例: `樹脂` `壺`）も検索できます")
+
+query = st.text_input("検索キーワード", "", key='query')
+
+# 入力した言葉の続きの候補。ない言葉や書き間違いで検索し直さなくて済むように、件数と一緒に出す
+if query.split():
+    suggestions = load_suggestions(query)
+    if suggestions:
+        st.caption("候補（件数はその言葉だけで検索したときの発言数）")
+        suggestion_cols = st.columns(SUGGESTIONS)
+        for i, (term, hits) in enumerate(suggestions):
+            suggestion_cols[i].button(f"{term}（{hits}件）", key=f"suggest_{term}",
+                                      on_click=use_suggestion, args=(term,))
+
+# 絞り込み
+with st.sidebar:
+    st.header("絞り込み")
+    videos = load_videos()
+    use_date_range = st.checkbox("配信日で絞り込む")
+    date_from = date_to = None
+    if use_date_range and videos:
+        first = datetime.datetime.strptime(videos[-1][1], '%Y%m%d').date()
+        last = datetime.datetime.strptime(videos[0][1], '%Y%m%d').date()
+        date_range = st.date_input("配信日", (first, last), min_value=first, max_value=last)
+        if len(date_range) == 2:
+            date_from, date_to = (d.strftime('%Y%m%d') for d in date_range)
+    tags = load_tags()
+    tag_labels = dict(tags)
+    tag = st.selectbox(
+        "タグ",
+        [None] + [t[0] for t in tags],
+        key='tag',
+        format_func=lambda t: "すべてのタグ" if t is None else f"{t}（{tag_labels[t]}本）",
+        help="動画タイトルの【】で囲まれた部分",
+    )
+    month = st.selectbox(
+        "配信月",
+        [None] + sorted({v[1][:6] for v in videos}, reverse=True),
+        key='month',
+        format_func=lambda m: "すべての月" if m is None else f"{m[:4]}年{m[4:]}月",
+    )
+    video_options = [None] + [v[0] for v in videos]
+    video_labels = {v[0]: f"{format_date(v[1])} {v[2]}" for v in videos}
+    video_id = st.selectbox(
+        "動画",
+        video_options,
+        format_func=lambda v: "すべての動画" if v is None else video_labels[v],
+    )
+
+    spans = st.checkbox("字幕の切れ目をまたぐ言葉も探す", value=True,
+                        help="2行の字幕に分かれて表示された言葉も見つけます（3文字以上の言葉のみ）")
+
+    st.header("表示")
+    context_size = st.slider("前後の発言", 0, 5, 0, help="ヒットした発言の前後に表示する字幕の数")
+    collapse = st.checkbox("動画ごとに折りたたむ", value=True,
+                           help="先に動画の一覧だけを表示し、開いた動画の発言だけを読み込みます"
+                                "（並び順が「意味の近さも考慮」のときは使えません）")
+
+    ingest_status = load_ingest_status()
+    if ingest_status:
+        ingested_at, lag = ingest_status
+        st.caption(f"最終取り込み: {datetime.datetime.fromtimestamp(ingested_at):%Y/%m/%d %H:%M}"
+                   f"（字幕ファイルの追加から {lag:.0f} 秒）")
 
-query = st.text_input("検索キーワード", "")
+# 意味検索は embed_db.py でベクトルを作ってあるときだけ選べる
+orders = [o for o in ORDER_LABELS if o != 'hybrid' or vector_index.available()]
+order = st.radio("並び順", orders, format_func=ORDER_LABELS.get, horizontal=True)
 
 if query:
+    filters = {'date_from': date_from, 'date_to': date_to, 'video_id': video_id,
+               'month': month, 'tag': tag}
+
+    # ページ送り用のカーソル。検索条件が変わったら1ページ目に戻す
+    page_key = (query, tuple(sorted(filters.items())), order, spans)
+    if st.session_state.get('page_key') != page_key:
+        st.session_state.page_key = page_key
+        st.session_state.cursors = [None]
+        st.session_state.video_page = 0
+        # 開いていた動画も閉じる（開いたままだと、新しい検索で最初から読み込んでしまう）
+        for key in [k for k in st.session_state if k.startswith(('open_', 'limit_'))]:
+            del st.session_state[key]
+    cursors = st.session_state.cursors
+
+    # 折りたたみ表示は動画ごとのヒット数で並べるので、意味検索を混ぜる並び順では使えない
+    lazy = collapse and order != 'hybrid'
+
     with st.spinner('検索中...'):
-        raw_results = search_db(query)
-    
-    if raw_results:
-        grouped_data = group_results(raw_results)
-        total_matches = len(raw_results)
-        total_videos = len(grouped_data)
+        # 月別・タグ別の件数は、タグ・月・動画を選ぶ前の全体の分布を見せる
+        facets = load_facets(query, {'date_from': date_from, 'date_to': date_to}, spans)
+        if lazy:
+            # 発言は読まずに、動画ごとの件数だけを集計する。ヒット数が多くても表示までの時間は変わらない
+            video_list = load_video_hits(query, filters, order, spans)
+        else:
+            raw_results, next_cursor = search_db(query, filters, order, cursors[-1], spans)
+            total_matches, total_videos = count_hits(query, filters, spans)
+
+    if lazy:
+        if video_list:
+            page = st.session_state.video_page
+            shown = video_list[page * VIDEOS_PER_PAGE:(page + 1) * VIDEOS_PER_PAGE]
+            first = page * VIDEOS_PER_PAGE + 1
+            last = first + len(shown) - 1
+            st.success(f"{len(video_list)} 本の動画で {sum(v['hits'] for v in video_list)} 件の発言が見つかりました"
+                       f"（{first}〜{last} 本目の動画を表示）")
+            show_facets(facets)
+            for video in shown:
+                video_matches(video, query, filters, order, spans, context_size)
+
+            prev_col, next_col = st.columns(2)
+            with prev_col:
+                if page > 0:
+                    st.button("◀ 前のページ", on_click=turn_video_page, args=(-1,))
+            with next_col:
+                if last < len(video_list):
+                    st.button("次のページ ▶", on_click=turn_video_page, args=(1,))
+        else:
+            st.warning("見つかりませんでした。別の言葉で試してみてください。")
+    elif raw_results:
+        grouped_data = search_index.group_results(raw_results, query)
+        around = load_context(raw_results, context_size)
+        first = (len(cursors) - 1) * search_index.PAGE_SIZE + 1
+        last = first + len(raw_results) - 1
         
-        st.success(f"{total_videos} 本の動画で {total_matches} 件の発言が見つかりました")
+        if order == 'hybrid':
+            st.success(f"キーワードに一致した {total_matches} 件の発言と、意味の近い場面を表示しています"
+                       f"（{first}〜{last} 件目）")
+        else:
+            st.success(f"{total_videos} 本の動画で {total_matches} 件の発言が見つかりました"
+                       f"（{first}〜{last} 件目を表示）")
+
+        show_facets(facets)
         
         for key, data in grouped_data.items():
             formatted_date = format_date(data['date'])
@@ -137,14 +376,33 @@ if query:
                 
                 # Show matches in an expander if there are many, or just list them
                 # Default open if it's a small number of matches
-                with st.expander(f"💬 発言箇所 ({len(matches)}件)", expanded=True):
+                video_hits = facets['videos'].get(key, 0)
+                label = (f"💬 発言箇所 ({len(matches)}件)" if video_hits <= len(matches)
+                         else f"💬 発言箇所 (この動画の全 {video_hits} 件のうち {len(matches)} 件)")
+                with st.expander(label, expanded=True):
                     for match in matches:
                         # Use columns for better layout: Timestamp/Link | Text
                         c1, c2 = st.columns([1, 4])
                         with c1:
-                            st.markdown(f"[▶️ {match['timestamp']}]({match['url']})")
+                            # 単語ごとの時刻があれば、検索語を話した瞬間から再生する
+                            timestamp = format_timestamp(match['match_ms'])
+                            url = video_url(match['video_id'], match['match_ms'])
+                            st.markdown(f"[▶️ {timestamp}]({url})")
                         with c2:
+                            before, after = around.get(match['id'], ([], []))
+                            if before:
+                                st.caption('  \n'.join(line['text'] for line in before))
                             st.markdown(f"「{match['text']}」")
+                            if after:
+                                st.caption('  \n'.join(line['text'] for line in after))
                 st.divider()
+
+        prev_col, next_col = st.columns(2)
+        with prev_col:
+            if len(cursors) > 1:
+                st.button("◀ 前のページ", on_click=cursors.pop)
+        with next_col:
+            if next_cursor is not None:
+                st.button("次のページ ▶", on_click=cursors.append, args=(next_cursor,))
     else:
         st.warning("見つかりませんでした。別の言葉で試してみてください。")
\ No newline at end of file
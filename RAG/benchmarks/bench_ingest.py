@@ -0,0 +1,159 @@
+"""
+Ingest benchmark on a synthetic corpus.
+
+Times parse_vtt() over every file, a full rebuild, an incremental no-op
+run and an incremental run after changing, adding and deleting videos,
+and records the index size. Run from the RAG directory:
+
+    python -m benchmarks.bench_ingest --videos 1000 --out ingest.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import contextlib
+
+import vtt
+import rebuild_db
+from benchmarks import synth_corpus
+
+def timed(fn, *args, **kwargs):
+    """Runs fn with its output suppressed; returns (result, seconds)."""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def index_size(db_file):
+    """Total file size and, where SQLite has the dbstat table, bytes per table/index."""
+    size = {'bytes': os.path.getsize(db_file), 'tables': {}}
+    conn = sqlite3.connect(db_file)
+    try:
+        rows = conn.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC')
+        size['tables'] = dict(rows.fetchall())
+    except sqlite3.OperationalError:
+        pass
+    finally:
+        conn.close()
+    return size
+
+def caption_count(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute('SELECT count(*) FROM captions').fetchone()[0]
+    finally:
+        conn.close()
+
+def bench_parse(paths):
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    captions = 0
+    started = time.perf_counter()
+    for path in paths:
+        captions += len(vtt.parse_vtt(path))
+    seconds = time.perf_counter() - started
+    return {
+        'files': len(paths),
+        'bytes': total_bytes,
+        'captions': captions,
+        'seconds': seconds,
+        'files_per_s': len(paths) / seconds,
+        'mb_per_s': total_bytes / 1024 / 1024 / seconds,
+    }
+
+def change_corpus(corpus_dir, paths, ratio, lines, seed):
+    """Appends a line to, deletes and adds roughly `ratio` of the videos each; added videos have `lines` lines."""
+    by_video = {}
+    for path in paths:
+        video_id = rebuild_db.parse_filename(os.path.basename(path))[0]
+        by_video.setdefault(video_id, []).append(path)
+    video_ids = sorted(by_video)
+    step = max(1, round(1 / ratio)) if ratio > 0 else len(video_ids) + 1
+
+    changed = video_ids[::step]
+    for video_id in changed:
+        for path in by_video[video_id]:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('\n99:00:00.000 --> 99:00:01.000\n追加された字幕\n')
+    deleted = video_ids[1::step]
+    for video_id in deleted:
+        for path in by_video[video_id]:
+            os.remove(path)
+    added = synth_corpus.generate(corpus_dir, videos=len(changed), lines=lines, orig_ratio=0, seed=seed + 1)
+    return {'changed': len(changed), 'deleted': len(deleted), 'added': len(added)}
+
+def run(videos, lines, workers=1, change_ratio=0.01, seed=0, work_dir=None):
+    """Runs every ingest benchmark and returns the results as a dict."""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='rag_bench_')
+    corpus_dir = os.path.join(work_dir, 'vtt')
+    db_file = os.path.join(work_dir, 'bench.db')
+    results = {
+        'benchmark': 'ingest',
+        'params': {'videos': videos, 'lines': lines, 'workers': workers,
+                   'change_ratio': change_ratio, 'seed': seed},
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+    }
+    try:
+        paths, seconds = timed(synth_corpus.generate, corpus_dir, videos, lines, seed=seed)
+        results['corpus'] = {'files': len(paths), 'generate_seconds': seconds}
+
+        results['parse'] = bench_parse(paths)
+
+        _, seconds = timed(rebuild_db.rebuild_database, full=True, data_dir=corpus_dir,
+                           db_file=db_file, workers=workers)
+        rows = caption_count(db_file)
+        results['full_rebuild'] = {'seconds': seconds, 'rows': rows, 'rows_per_s': rows / seconds}
+        results['index_size'] = index_size(db_file)
+
+        _, seconds = timed(rebuild_db.rebuild_database, data_dir=corpus_dir,
+                           db_file=db_file, workers=workers)
+        results['incremental_noop'] = {'seconds': seconds}
+
+        changes = change_corpus(corpus_dir, paths, change_ratio, lines, seed)
+        _, seconds = timed(rebuild_db.rebuild_database, data_dir=corpus_dir,
+                           db_file=db_file, workers=workers)
+        results['incremental_update'] = dict(changes, seconds=seconds, rows=caption_count(db_file))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VTT ingest on a synthetic corpus.")
+    parser.add_argument('--videos', type=int, default=1000, help="number of synthetic videos")
+    parser.add_argument('--lines', type=int, default=300, help="average spoken lines per video")
+    parser.add_argument('--workers', type=int, default=1, help="rebuild_db --workers")
+    parser.add_argument('--change-ratio', type=float, default=0.01,
+                        help="fraction of videos changed, deleted and added for the incremental run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="write the results to this JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    results = run(args.videos, args.lines, args.workers, args.change_ratio, args.seed)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Results written to {args.out}")
+    else:
+        print(text)
+
+    print(f"parse: {results['parse']['files_per_s']:.1f} files/s, "
+          f"{results['parse']['mb_per_s']:.1f} MB/s", file=sys.stderr)
+    print(f"full rebuild: {results['full_rebuild']['seconds']:.2f}s, "
+          f"{results['full_rebuild']['rows_per_s']:.0f} rows/s, "
+          f"{results['index_size']['bytes'] / 1024 / 1024:.1f} MB", file=sys.stderr)
+    print(f"incremental: no-op {results['incremental_noop']['seconds']:.2f}s, "
+          f"update {results['incremental_update']['seconds']:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Search latency benchmark: replays a query log against one or more databases.
+
+Each database is benchmarked with the search path that matches its schema:
+'legacy' for the original single `subtitles` FTS table (queried and grouped
+the way the original app.py did), 'current' for search_index.py. Passing
+two databases compares them side by side. Run from the RAG directory:
+
+    python -m benchmarks.bench_search --db kunue_rii.db --db old.db --concurrency 4
+
+Latency covers a whole request as the app makes it: the first result page,
+the hit counts (current schema only) and grouping by video.
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import platform
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import search_index
+
+QUERY_LOG = os.path.join(os.path.dirname(__file__), 'queries.txt')
+
+# SQLite calls the progress handler every this many VM instructions while
+# a query is profiled; the step count is reported as a rows-scanned proxy.
+PROGRESS_STEP = 100
+
+def load_queries(path):
+    """One query per line; blank lines and lines starting with # are ignored."""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def detect_schema(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    finally:
+        conn.close()
+    if 'captions' in names:
+        return 'current'
+    if 'subtitles' in names:
+        return 'legacy'
+    raise ValueError(f"{db_file}: no subtitles or captions table")
+
+class LegacyBackend:
+    """The original app.py search: a new connection per query, LIMIT 200, sorted and grouped in Python."""
+
+    def __init__(self, db_file, cache_size=0):
+        self.db_file = db_file
+
+    def _search(self, conn, query):
+        rows = conn.execute('''
+            SELECT date, title, text, timestamp, url
+            FROM subtitles
+            WHERE subtitles MATCH ?
+            LIMIT 200
+        ''', (query,)).fetchall()
+        grouped = defaultdict(list)
+        for date, title, text, timestamp, url in sorted(rows, key=lambda x: x[0], reverse=True):
+            grouped[f"{date}_{title}"].append((text, timestamp, url))
+        return len(rows)
+
+    def run(self, query):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return self._search(conn, query)
+        finally:
+            conn.close()
+
+    def profile(self, query, progress):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            conn.set_progress_handler(progress, PROGRESS_STEP)
+            return self._search(conn, query)
+        finally:
+            conn.close()
+
+class CurrentBackend:
+    """search_index.py as app.py uses it: first page, counts and grouping."""
+
+    def __init__(self, db_file, cache_size=0):
+        search_index.DB_FILE = db_file
+        search_index.RESULT_CACHE_SIZE = cache_size
+        # --cache 0 measures the database, so no decompressed text is kept either.
+        search_index.TEXT_CACHE_SIZE = cache_size and search_index.TEXT_CACHE_SIZE
+        with search_index._lock:
+            search_index._results.clear()
+            search_index._text_blocks.clear()
+
+    def run(self, query):
+        rows, _ = search_index.search(query, spans=True)
+        search_index.count(query, spans=True)
+        search_index.group_results(rows, query)
+        return len(rows)
+
+    def profile(self, query, progress):
+        # Hold one connection for the whole query, so every statement of it
+        # runs under the handler.
+        with search_index.connection() as conn:
+            conn.set_progress_handler(progress, PROGRESS_STEP)
+            try:
+                return self.run(query)
+            finally:
+                conn.set_progress_handler(None, 0)
+
+BACKENDS = {'legacy': LegacyBackend, 'current': CurrentBackend}
+
+def timed_run(backend, query):
+    started = time.perf_counter()
+    try:
+        rows = backend.run(query)
+        error = None
+    except sqlite3.Error as e:
+        rows, error = 0, str(e)
+    return time.perf_counter() - started, rows, error
+
+_worker_backend = None
+
+def _init_worker(schema, db_file, cache_size):
+    global _worker_backend
+    _worker_backend = BACKENDS[schema](db_file, cache_size)
+
+def _worker_run(query):
+    return timed_run(_worker_backend, query)
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+def profile_queries(backend, queries):
+    """Runs each distinct query once, single-threaded, counting VM steps."""
+    profiles = {}
+    for query in dict.fromkeys(queries):
+        steps = [0]
+        def progress():
+            steps[0] += PROGRESS_STEP
+            return 0
+        try:
+            rows = backend.profile(query, progress)
+        except sqlite3.Error as e:
+            profiles[query] = {'error': str(e)}
+            continue
+        profiles[query] = {'rows': rows, 'vm_steps': steps[0]}
+    return profiles
+
+def replay(db_file, queries, concurrency=1, mode='thread', cache_size=0, schema=None):
+    """Replays queries against db_file and returns latency and throughput figures."""
+    schema = schema or detect_schema(db_file)
+    backend = BACKENDS[schema](db_file, cache_size)
+    profiles = profile_queries(backend, queries)
+
+    if mode == 'process':
+        pool = ProcessPoolExecutor(concurrency, initializer=_init_worker,
+                                   initargs=(schema, db_file, cache_size))
+        run = _worker_run
+    else:
+        pool = ThreadPoolExecutor(concurrency)
+        run = lambda query: timed_run(backend, query)
+    with pool:
+        # Warm-up: start the workers and bring the database into the page cache.
+        list(pool.map(run, list(dict.fromkeys(queries)) * concurrency))
+        started = time.perf_counter()
+        timings = list(pool.map(run, queries))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(t for t, _, _ in timings)
+    by_query = defaultdict(list)
+    for query, (t, _, _) in zip(queries, timings):
+        by_query[query].append(t)
+    for query, times in by_query.items():
+        times.sort()
+        profiles[query]['p50_ms'] = percentile(times, 50) * 1000
+
+    ms = lambda v: v * 1000
+    return {
+        'db': db_file,
+        'schema': schema,
+        'db_bytes': os.path.getsize(db_file),
+        'queries': len(queries),
+        'errors': sum(1 for _, _, error in timings if error),
+        'wall_seconds': wall,
+        'queries_per_s': len(queries) / wall,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]),
+            'mean': ms(sum(latencies) / len(latencies)),
+        },
+        'per_query': profiles,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query log and measure search latency.")
+    parser.add_argument('--db', action='append',
+                        help="database to benchmark; repeat to compare (default: kunue_rii.db)")
+    parser.add_argument('--log', default=QUERY_LOG, help="query log, one query per line")
+    parser.add_argument('--repeat', type=int, default=20, help="times the log is replayed")
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrent readers")
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread',
+                        help="readers are threads in one process (like Streamlit) or separate processes")
+    parser.add_argument('--cache', type=int, default=0,
+                        help="search_index result cache size (default 0: measure the database)")
+    parser.add_argument('--out', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    queries = load_queries(args.log) * args.repeat
+    results = {
+        'benchmark': 'search',
+        'params': {'log': args.log, 'repeat': args.repeat, 'concurrency': args.concurrency,
+                   'mode': args.mode, 'cache': args.cache},
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'runs': [],
+    }
+    for db_file in args.db or [search_index.DB_FILE]:
+        run = replay(db_file, queries, args.concurrency, args.mode, args.cache)
+        results['runs'].append(run)
+        latency = run['latency_ms']
+        print(f"{db_file} ({run['schema']}): {run['queries_per_s']:.1f} queries/s, "
+              f"p50 {latency['p50']:.2f} ms, p95 {latency['p95']:.2f} ms, p99 {latency['p99']:.2f} ms, "
+              f"{run['errors']} errors")
+        for query, profile in run['per_query'].items():
+            if 'error' in profile:
+                print(f"  {query}: error: {profile['error']}")
+            else:
+                print(f"  {query}: {profile['rows']} rows, {profile['vm_steps']} VM steps, "
+                      f"p50 {profile['p50_ms']:.2f} ms")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
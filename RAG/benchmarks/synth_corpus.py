@@ -0,0 +1,101 @@
+"""
+Generates a synthetic subtitle corpus shaped like 字幕データ.
+
+Files are named YYYYMMDD_TITLE_VIDEOID.ja.vtt and contain YouTube-style
+rolling auto-captions: each line appears as a word-timed cue (carrying
+over the previous line), followed by a 10 ms repeat cue. Output is
+deterministic for a given seed.
+
+    python -m benchmarks.synth_corpus OUT_DIR --videos 1000 --lines 300
+"""
+import os
+import random
+import string
+import argparse
+import datetime
+
+# Words the captions are assembled from, roughly the register of the corpus.
+WORDS = [
+    'はい', '皆さん', 'こんばんは', 'お疲れ様', 'です', 'ます', 'ということ', 'で', 'ね',
+    '今日', 'は', 'ガチャ', 'やって', 'いき', 'たい', 'と', '思い', 'めちゃめちゃ', '楽しみ',
+    'に', 'して', 'た', 'ん', 'これ', '全部', 'パート', '的', '言う', 'えっと', '原神',
+    '樹脂', '壺', '神子', 'イベント', '探索', '配信', 'ありがとう', 'ございます', 'あの',
+    'そう', 'なんか', 'すごい', '可愛い', '最高', 'ちょっと', '待って', 'やばい', '石',
+    '天井', '確定', 'すり抜け', '聖遺物', '武器', 'キャラ', '育成', '素材', '周回', '世界',
+]
+TAGS = ['【原神】', '【ピグパ】', '【雑談】', '【ポケコロ】', '【スターレイル】', '【鳴潮】']
+ID_CHARS = string.ascii_letters + string.digits + '-_'
+
+def format_timestamp(ms):
+    s, ms = divmod(ms, 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+def make_line(rng, start_ms):
+    """One spoken line as (plain text, word-timed VTT text, duration in ms)."""
+    words = rng.choices(WORDS, k=rng.randint(3, 10))
+    t = start_ms
+    timed = [words[0]]
+    for word in words[1:]:
+        t += rng.randint(80, 600)
+        timed.append(f"<{format_timestamp(t)}><c>{word}</c>")
+    return ''.join(words), ''.join(timed), t - start_ms + rng.randint(100, 800)
+
+def make_vtt(rng, lines):
+    """A rolling-caption VTT file with the given number of spoken lines."""
+    out = ['WEBVTT', 'Kind: captions', 'Language: ja', '']
+    t = rng.randint(0, 3000)
+    previous = ' '
+    for _ in range(lines):
+        text, timed, duration = make_line(rng, t)
+        end = t + duration
+        out += [f"{format_timestamp(t)} --> {format_timestamp(end)} align:start position:0%",
+                previous, timed, '']
+        out += [f"{format_timestamp(end)} --> {format_timestamp(end + 10)} align:start position:0%",
+                text, ' ', '']
+        previous = text
+        t = end + 10
+    return '\n'.join(out) + '\n'
+
+def video_filename(rng, index, start_date):
+    date = start_date + datetime.timedelta(days=index // 2)
+    title = rng.choice(TAGS) + ''.join(rng.choices(WORDS, k=rng.randint(2, 6))) + f"{index}"
+    video_id = ''.join(rng.choices(ID_CHARS, k=11))
+    return f"{date:%Y%m%d}_{title}_{video_id}"
+
+def generate(out_dir, videos=1000, lines=300, orig_ratio=0.5, seed=0):
+    """
+    Writes `videos` synthetic videos into out_dir and returns the file paths.
+
+    A fraction orig_ratio of them also get an identical .ja-orig.vtt copy,
+    as in the real corpus.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    start_date = datetime.date(2020, 1, 1)
+    paths = []
+    for index in range(videos):
+        base = os.path.join(out_dir, video_filename(rng, index, start_date))
+        content = make_vtt(rng, rng.randint(lines // 2, lines * 3 // 2))
+        suffixes = ['.ja.vtt'] + (['.ja-orig.vtt'] if rng.random() < orig_ratio else [])
+        for suffix in suffixes:
+            with open(base + suffix, 'w', encoding='utf-8') as f:
+                f.write(content)
+            paths.append(base + suffix)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic rolling-caption VTT corpus.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--videos', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=300, help="average spoken lines per video")
+    parser.add_argument('--orig-ratio', type=float, default=0.5,
+                        help="fraction of videos that also get a .ja-orig.vtt copy")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate(args.out_dir, args.videos, args.lines, args.orig_ratio, args.seed)
+    print(f"Wrote {len(paths)} files to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
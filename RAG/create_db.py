@@ -1,67 +1,85 @@
-import sqlite3
 import json
 import os
+import rebuild_db
+import vtt
 
 # 設定
 JSONL_FILE = 'kunue_rii_db.jsonl' 
 DB_FILE = 'kunue_rii.db'
 
+# 一度に読み込む JSONL の量（バイト）
+READ_CHUNK = 8 * 1024 * 1024
+
+def read_records(path):
+    """
+    JSONL を大きな塊で読み、塊ごとにまとめてデコードして1件ずつ返す。
+    壊れた行を含む塊だけは1行ずつ読み直し、その行を飛ばす。
+    """
+    with open(path, 'r', encoding='utf-8', buffering=READ_CHUNK) as f:
+        while True:
+            lines = f.readlines(READ_CHUNK)
+            if not lines:
+                break
+            try:
+                yield from json.loads('[' + ','.join(line for line in lines if line.strip()) + ']')
+            except json.JSONDecodeError:
+                for line in lines:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
 def create_database():
     if not os.path.exists(JSONL_FILE):
         print(f"エラー: {JSONL_FILE} が見つかりません。")
         return
 
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-
-    conn = sqlite3.connect(DB_FILE)
+    # rebuild_db.py --full と同じく一時ファイルに一括で書き込み、完成したら置き換える。
+    # それまでは検索アプリは古いデータベースを使い続ける。
+    generation = rebuild_db.read_generation(DB_FILE)
+    conn, tmp_file = rebuild_db.open_bulk_build(DB_FILE)
     c = conn.cursor()
 
-    # 高速検索（FTS5）用のテーブルを作成
-    c.execute('''
-    CREATE VIRTUAL TABLE subtitles USING fts5(
-        video_id,
-        date,
-        title,
-        text,
-        timestamp,
-        url
-    )
-    ''')
-
     print("データを変換中...（数分かかる場合があります）")
     
     count = 0
     batch_data = []
+    next_seq = {}  # 動画ごとの字幕の通し番号
     
-    with open(JSONL_FILE, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                data = json.loads(line)
-                batch_data.append((
-                    data['video_id'],
-                    data.get('date', 'Unknown'),
-                    data.get('title', 'No Title'),
-                    data['text'],
-                    data['timestamp'],
-                    data['url']
-                ))
-                count += 1
-            except json.JSONDecodeError:
-                continue
+    for data in read_records(JSONL_FILE):
+        video_id = data['video_id']
+        if video_id not in next_seq:
+            next_seq[video_id] = 0
+            rebuild_db.add_video(c, (
+                video_id,
+                data.get('date', 'Unknown'),
+                data.get('title', 'No Title')
+            ))
+        batch_data.append((
+            video_id,
+            next_seq[video_id],
+            vtt.parse_timestamp(data['timestamp']),
+            data['text'],
+            None
+        ))
+        next_seq[video_id] += 1
+        count += 1
 
-            if count % 10000 == 0:
-                c.executemany('INSERT INTO subtitles VALUES (?,?,?,?,?,?)', batch_data)
-                conn.commit()
-                batch_data = []
-                print(f"{count} 行処理完了...")
+        if len(batch_data) >= 10000:
+            rebuild_db.insert_captions(c, batch_data)
+            batch_data = []
+            print(f"{count} 行処理完了...")
 
     if batch_data:
-        c.executemany('INSERT INTO subtitles VALUES (?,?,?,?,?,?)', batch_data)
-        conn.commit()
+        rebuild_db.insert_captions(c, batch_data)
+
+    # 字幕テキストの圧縮と検索用インデックスの作成は最後にまとめて行う
+    print("検索用インデックスを作成中...")
+    rebuild_db.build_fts(c)
+    rebuild_db.set_meta(conn, 'generation', generation + 1)
+    rebuild_db.finish_bulk_build(conn, tmp_file, DB_FILE)
 
     print(f"完了！合計 {count} 行のデータをデータベース化しました。")
-    conn.close()
 
 if __name__ == "__main__":
-    create_database()
\ No newline at end of file
+    create_database()
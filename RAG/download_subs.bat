@@ -4,7 +4,8 @@ echo ========================================================
 echo  薫衣りぃ RAG 字幕ダウンローダー
 echo ========================================================
 echo.
-echo YouTubeのURLを入力すると、字幕をダウンロードして
+echo YouTubeの動画・再生リスト・チャンネルのURLを入力すると、
+echo まだ取り込んでいない動画の字幕をまとめてダウンロードして
 echo データベースを自動更新します。
 echo.
 
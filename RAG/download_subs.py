@@ -1,14 +1,42 @@
 import os
 import subprocess
 import re
+import glob
 import shutil
-import sys
-from datetime import datetime
+import sqlite3
+import time
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import rebuild_db
 
 # Configuration
 DATA_DIR = r'd:/薫衣りぃ/RAG/字幕データ'
 
+# Videos downloaded at the same time in batch mode. Each one is a yt-dlp
+# process mostly waiting on the network.
+WORKERS = 4
+
+# A failed download is retried this many times, waiting BACKOFF_SECONDS,
+# then twice that, and so on (plus up to 50% jitter), so a rate-limited
+# batch slows down instead of failing every remaining video.
+RETRIES = 3
+BACKOFF_SECONDS = 5
+
+# yt-dlp errors that will not go away on a retry.
+PERMANENT_ERRORS = ('Private video', 'Video unavailable', 'members-only', 'This live event will begin')
+
+VIDEO_ID_PATTERN = re.compile(r'^[a-zA-Z0-9_-]{11}$')
+
+_print_lock = threading.Lock()
+
+def log(message, video_id=None):
+    """print() that keeps the lines of parallel downloads whole, tagged with the video."""
+    with _print_lock:
+        print(f"[{video_id}] {message}" if video_id else message, flush=True)
+
 def sanitize_filename(name):
     """
     Sanitize the filename by removing or replacing illegal characters.
@@ -17,102 +45,205 @@ def sanitize_filename(name):
     name = re.sub(r'[\\/*?:"<>|]', '', name)
     return name.strip()
 
-def download_subtitle(url):
+def decode_output(data):
+    """yt-dlp output is UTF-8, or the console code page on Japanese Windows."""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp932', errors='replace')
+
+def run_yt_dlp(args):
+    """Runs yt-dlp and returns (return code, stdout, stderr) as text."""
+    # Don't specify encoding here, decode manually
+    result = subprocess.run(['yt-dlp'] + args, capture_output=True)
+    return result.returncode, decode_output(result.stdout).strip(), decode_output(result.stderr).strip()
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+def list_video_ids(url, depth=1):
+    """
+    Video IDs behind a URL: a video, a playlist or a channel.
+
+    --flat-playlist lists the entries without visiting each video. A
+    channel's top page lists its tabs (videos, streams...) rather than
+    videos, so entries that are not videos are expanded once more.
+    """
+    code, out, err = run_yt_dlp(['--flat-playlist', '--print', '%(id)s\t%(url)s', url])
+    if code != 0:
+        raise RuntimeError(f"Could not list {url}: {err}")
+    video_ids = []
+    for line in out.splitlines():
+        entry_id, _, entry_url = line.partition('\t')
+        if VIDEO_ID_PATTERN.match(entry_id):
+            video_ids.append(entry_id)
+        elif depth > 0 and entry_url and entry_url != 'NA':
+            video_ids.extend(list_video_ids(entry_url, depth - 1))
+    return list(dict.fromkeys(video_ids))
+
+def known_video_ids(data_dir=None, db_file=None):
+    """IDs of videos that already have a subtitle file in data_dir or are in the database."""
+    data_dir = data_dir or DATA_DIR
+    db_file = db_file or rebuild_db.DB_FILE
+    known = set()
+    for file_path in glob.glob(os.path.join(data_dir, '*.vtt')):
+        parsed = rebuild_db.parse_filename(os.path.basename(file_path))
+        if parsed:
+            known.add(parsed[0])
+    if os.path.exists(db_file):
+        conn = sqlite3.connect(db_file)
+        try:
+            known.update(row[0] for row in conn.execute('SELECT id FROM videos'))
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+    return known
+
+class DownloadError(Exception):
+    """yt-dlp failed; `retryable` when another attempt may succeed (network, rate limit)."""
+
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+def download_subtitle(url, data_dir=None):
     """
     Downloads the subtitle for the given YouTube URL.
     Returns the path to the downloaded file or None if failed.
+
+    A single yt-dlp call prints the metadata (title, upload date, ID) and
+    writes the subtitle: --print alone would skip the download, so
+    --no-simulate is given too. Raises DownloadError when yt-dlp fails.
     """
-    print(f"Processing URL: {url}")
-    
+    data_dir = data_dir or DATA_DIR
+    # Each download gets its own temp directory, so parallel downloads
+    # never see each other's files.
+    temp_dir = tempfile.mkdtemp(prefix='subs_')
     try:
-        # 1. Get Metadata (Title, Upload Date, ID)
-        # We use --print to get specific fields
-        cmd_meta = [
-            'yt-dlp',
+        code, output, err_msg = run_yt_dlp([
             '--print', '%(upload_date)s\t%(title)s\t%(id)s',
+            '--no-simulate',
+            '--write-sub', '--write-auto-sub', '--sub-lang', 'ja',
+            '--skip-download',  # Don't download video
+            '--output', os.path.join(temp_dir, 'temp_%(id)s'),
             url
-        ]
-        
-        print("Fetching metadata...")
-        # Don't specify encoding here, decode manually
-        result = subprocess.run(cmd_meta, capture_output=True)
-        
-        if result.returncode != 0:
-            # Try to decode stderr for logging
-            try:
-                err_msg = result.stderr.decode('utf-8')
-            except:
-                err_msg = result.stderr.decode('cp932', errors='replace')
-            print(f"Error fetching metadata: {err_msg}")
-            return None
-            
-        # Try decoding stdout with utf-8, then cp932
-        try:
-            output = result.stdout.decode('utf-8').strip()
-        except UnicodeDecodeError:
-            output = result.stdout.decode('cp932', errors='replace').strip()
+        ])
+
+        if code != 0:
+            raise DownloadError(err_msg or f"yt-dlp exited with code {code}",
+                                not any(error in err_msg for error in PERMANENT_ERRORS))
 
         if not output:
-            print("No metadata found.")
+            log("No metadata found.", url)
             return None
-            
-        upload_date, title, video_id = output.split('\t')
-        print(f"Found video: {title} ({upload_date}) [ID: {video_id}]")
-        
-        # 2. Download Subtitle
-        # We want Japanese subtitles (.ja.vtt)
-        # We will download it to the current directory first with a temporary name
-        temp_filename_template = f"temp_{video_id}"
-        
-        cmd_download = [
-            'yt-dlp',
-            '--write-sub', '--write-auto-sub', '--sub-lang', 'ja',
-            '--skip-download',  # Don't download video
-            '--output', temp_filename_template,
-            url
-        ]
-        
-        print("Downloading subtitle...")
-        subprocess.run(cmd_download, check=True)
-        
+
+        upload_date, title, video_id = output.splitlines()[0].split('\t')
+        log(f"Found video: {title} ({upload_date})", video_id)
+
         # yt-dlp appends the language code and extension, e.g., temp_VIDEOID.ja.vtt
-        downloaded_file = f"{temp_filename_template}.ja.vtt"
-        
+        downloaded_file = os.path.join(temp_dir, f"temp_{video_id}.ja.vtt")
         if not os.path.exists(downloaded_file):
-            print("Subtitle file was not downloaded. It might not be available in Japanese.")
+            log("Subtitle file was not downloaded. It might not be available in Japanese.", video_id)
             return None
-            
-        # 3. Rename and Move
+
+        # Rename and Move
         sanitized_title = sanitize_filename(title)
         new_filename = f"{upload_date}_{sanitized_title}_{video_id}.ja.vtt"
-        destination_path = os.path.join(DATA_DIR, new_filename)
-        
-        # Move file
+        destination_path = os.path.join(data_dir, new_filename)
         shutil.move(downloaded_file, destination_path)
-        print(f"Saved subtitle to: {destination_path}")
-        
+        log(f"Saved subtitle to: {destination_path}", video_id)
         return destination_path
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
-    except FileNotFoundError:
-        print("Error: yt-dlp not found. Please ensure yt-dlp is installed and in your PATH.")
-        return None
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+def download_with_retry(video_id, retries=RETRIES, data_dir=None):
+    """download_subtitle() of one video with exponential backoff on temporary failures."""
+    for attempt in range(retries + 1):
+        try:
+            return download_subtitle(video_url(video_id), data_dir)
+        except DownloadError as e:
+            if not e.retryable:
+                log(f"Skipping: {str(e).splitlines()[-1]}", video_id)
+                return None
+            if attempt == retries:
+                log(f"Giving up after {retries + 1} attempts: {e}", video_id)
+                return None
+            delay = BACKOFF_SECONDS * 2 ** attempt * (1 + random.random() / 2)
+            log(f"Attempt {attempt + 1} failed, retrying in {delay:.0f}s: {str(e).splitlines()[-1]}", video_id)
+            time.sleep(delay)
+        except Exception as e:
+            # Anything else (unexpected yt-dlp output, a failed move) skips
+            # this video only, so the rest of the batch is still indexed.
+            log(f"Error: {e}", video_id)
+            return None
+
+def download_batch(urls, workers=WORKERS, retries=RETRIES, data_dir=None):
+    """
+    Downloads the subtitles of every video behind urls (videos, playlists,
+    channels) that is not on disk or in the database yet.
+
+    Returns the paths of the new subtitle files.
+    """
+    video_ids = []
+    for url in urls:
+        try:
+            found = list_video_ids(url)
+        except (RuntimeError, FileNotFoundError) as e:
+            log(f"Error: {e}")
+            continue
+        log(f"{url}: {len(found)} videos")
+        video_ids.extend(found)
+    video_ids = list(dict.fromkeys(video_ids))
+
+    known = known_video_ids(data_dir)
+    todo = [v for v in video_ids if v not in known]
+    log(f"{len(video_ids) - len(todo)} videos already downloaded, {len(todo)} to download.")
+    if not todo:
+        return []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda v: download_with_retry(v, retries, data_dir), todo))
+    saved = [path for path in results if path]
+    log(f"Downloaded {len(saved)} subtitles, {len(todo) - len(saved)} failed or unavailable.")
+    return saved
+
+def read_url_list(path):
+    """URLs from a text file, one per line; blank lines and # comments are ignored."""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
 
 def main():
-    if len(sys.argv) > 1:
-        url = sys.argv[1]
-    else:
-        url = input("YouTube URLを入力してください: ").strip()
-    
-    if not url:
+    parser = argparse.ArgumentParser(
+        description="Download Japanese subtitles into the data folder and update the database.")
+    parser.add_argument('urls', nargs='*', help="video, playlist or channel URLs")
+    parser.add_argument('--list', metavar='FILE', help="text file with one URL per line")
+    parser.add_argument('--workers', type=int, default=WORKERS, metavar='N',
+                        help=f"videos downloaded at the same time (default: {WORKERS})")
+    parser.add_argument('--retries', type=int, default=RETRIES, metavar='N',
+                        help=f"retries per video on temporary errors (default: {RETRIES})")
+    args = parser.parse_args()
+
+    urls = list(args.urls)
+    if args.list:
+        urls.extend(read_url_list(args.list))
+    if not urls:
+        url = input("YouTube URLを入力してください（動画・再生リスト・チャンネル）: ").strip()
+        if url:
+            urls.append(url)
+
+    if not urls:
         print("URLが入力されませんでした。")
         return
 
-    file_path = download_subtitle(url)
-    
-    if file_path:
+    if shutil.which('yt-dlp') is None:
+        print("Error: yt-dlp not found. Please ensure yt-dlp is installed and in your PATH.")
+        return
+
+    saved = download_batch(urls, args.workers, args.retries)
+
+    # One incremental update for the whole batch: only the new files are parsed.
+    if saved:
         print("\nUpdating database...")
         try:
             rebuild_db.rebuild_database()
@@ -120,7 +251,7 @@ def main():
         except Exception as e:
             print(f"Error updating database: {e}")
     else:
-        print("\nFailed to download subtitle.")
+        print("\nNo new subtitles downloaded.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import hashlib
+import argparse
+import time
+
+import textstore
+
+# Configuration
+DB_FILE = 'kunue_rii.db'
+VECTOR_DB_FILE = 'kunue_rii_vec.db'
+
+# Sentence embedding model, run locally on the CPU through
+# sentence-transformers. The e5 models expect these prefixes on the text.
+MODEL_NAME = 'intfloat/multilingual-e5-small'
+PASSAGE_PREFIX = 'passage: '
+QUERY_PREFIX = 'query: '
+
+# Consecutive captions embedded together as one window (about 15-30 s of
+# speech). Windows do not overlap, so caption seq // WINDOW_CAPTIONS is its
+# window. Changing this re-embeds every video.
+WINDOW_CAPTIONS = 6
+
+# Windows per model call.
+BATCH_SIZE = 64
+
+# Windows embedded between progress reports.
+PROGRESS_WINDOWS = 10000
+
+def load_model(name=MODEL_NAME):
+    """Loads the embedding model; needs `pip install sentence-transformers`."""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device='cpu')
+
+def encode(model, texts, prefix=PASSAGE_PREFIX):
+    """Unit-length float32 embeddings of texts, one row per text."""
+    return model.encode([prefix + text for text in texts], batch_size=BATCH_SIZE,
+                        normalize_embeddings=True, convert_to_numpy=True)
+
+def quantize(vectors):
+    """
+    int8 rows and a float32 scale per row, vectors ~= rows * scale.
+
+    Each row is scaled so its largest component is 127; a quarter of the
+    size of float32, and the dot products rank like the originals.
+    """
+    import numpy as np
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    rows = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return rows, scales.astype(np.float32)
+
+def matrix_path(vector_db_file, name):
+    return os.path.join(os.path.dirname(os.path.abspath(vector_db_file)), name)
+
+def create_schema(conn):
+    c = conn.cursor()
+
+    # One row per embedded window; `row` is its row in the matrix file and
+    # scale the factor from quantize().
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS windows (
+        row INTEGER PRIMARY KEY,
+        video_id TEXT NOT NULL,
+        seq_lo INTEGER NOT NULL,
+        seq_hi INTEGER NOT NULL,
+        scale REAL NOT NULL
+    )
+    ''')
+
+    # What each video's windows were computed from (see video_windows).
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS videos (
+        video_id TEXT PRIMARY KEY,
+        hash TEXT NOT NULL
+    )
+    ''')
+
+    # model, window_captions, dim, and `matrix`: the file name of the
+    # current matrix, next to the database.
+    c.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+def get_meta(conn, key, default=None):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+def video_windows(db_file):
+    """
+    Reads the captions and splits each video into windows.
+
+    Returns {video_id: (hash, [(seq_lo, seq_hi, text), ...])}, the hash
+    covering the caption texts and the window layout, so a video whose
+    captions did not change keeps its vectors.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        videos = {}
+        for video_id, texts in textstore.iter_video_texts(conn):
+            captions = list(enumerate(texts))
+            h = hashlib.sha1(f'{WINDOW_CAPTIONS}\n'.encode())
+            windows = []
+            for i in range(0, len(captions), WINDOW_CAPTIONS):
+                chunk = captions[i:i + WINDOW_CAPTIONS]
+                text = ' '.join(caption[1] for caption in chunk)
+                h.update(text.encode() + b'\n')
+                windows.append((chunk[0][0], chunk[-1][0], text))
+            videos[video_id] = (h.hexdigest(), windows)
+        return videos
+    finally:
+        conn.close()
+
+def remove_stale_matrices(vector_db_file, current):
+    """Deletes matrix files other than `current`; one still mapped by the app (Windows) is left for next time."""
+    prefix = os.path.splitext(os.path.basename(vector_db_file))[0] + '.'
+    directory = os.path.dirname(os.path.abspath(vector_db_file))
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.npy') and name != current:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+def embed_database(full=False, db_file=None, vector_db_file=None, model_name=MODEL_NAME):
+    """
+    Brings the vector index in line with the captions in db_file.
+
+    Run after rebuild_db.py. Only videos whose captions changed are
+    embedded again; the vectors of the others are copied over. The matrix
+    is written to a new file named after a counter and only then recorded
+    in the vector database, so the search app keeps using the previous
+    matrix until the update is committed.
+    """
+    import numpy as np
+
+    db_file = db_file or DB_FILE
+    vector_db_file = vector_db_file or VECTOR_DB_FILE
+    videos = video_windows(db_file)
+    print(f"Found {sum(len(w) for _, w in videos.values())} windows in {len(videos)} videos.")
+
+    conn = sqlite3.connect(vector_db_file)
+    conn.execute('BEGIN')
+    create_schema(conn)
+    c = conn.cursor()
+
+    old_matrix = get_meta(conn, 'matrix')
+    if (full or old_matrix is None or get_meta(conn, 'model') != model_name
+            or get_meta(conn, 'window_captions') != WINDOW_CAPTIONS):
+        old_hashes = {}
+    else:
+        old_hashes = dict(c.execute('SELECT video_id, hash FROM videos'))
+    kept = sorted(v for v in videos if old_hashes.get(v) == videos[v][0])
+    changed = sorted(v for v in videos if old_hashes.get(v) != videos[v][0])
+    removed = len(set(old_hashes) - set(videos))
+    if not changed and not removed and old_hashes:
+        conn.rollback()
+        conn.close()
+        print(f"Vector index is up to date ({len(kept)} videos).")
+        return
+
+    started = time.perf_counter()
+    new_windows = [(v, lo, hi, text) for v in changed for lo, hi, text in videos[v][1]]
+    if new_windows:
+        print(f"Embedding {len(new_windows)} windows of {len(changed)} videos with {model_name}...")
+        model = load_model(model_name)
+        dim = model.get_sentence_embedding_dimension()
+    else:
+        dim = int(get_meta(conn, 'dim'))
+
+    # Rows of unchanged videos, in matrix order, to copy from the old matrix.
+    kept_rows = []
+    if kept:
+        kept_set = set(kept)
+        kept_rows = [row for row in c.execute(
+            'SELECT row, video_id, seq_lo, seq_hi, scale FROM windows ORDER BY row')
+            if row[1] in kept_set]
+
+    generation = int(get_meta(conn, 'generation', 0)) + 1
+    name = f'{os.path.splitext(os.path.basename(vector_db_file))[0]}.{generation}.npy'
+    total = len(kept_rows) + len(new_windows)
+    matrix = np.lib.format.open_memmap(matrix_path(vector_db_file, name), mode='w+',
+                                       dtype=np.int8, shape=(total, dim))
+    windows = []
+    if kept_rows:
+        old = np.load(matrix_path(vector_db_file, old_matrix), mmap_mode='r')
+        matrix[:len(kept_rows)] = old[[row[0] for row in kept_rows]]
+        del old
+        windows.extend(row[1:] for row in kept_rows)
+
+    for i in range(0, len(new_windows), PROGRESS_WINDOWS):
+        batch = new_windows[i:i + PROGRESS_WINDOWS]
+        rows, scales = quantize(encode(model, [w[3] for w in batch]))
+        start = len(windows)
+        matrix[start:start + len(batch)] = rows
+        windows.extend((v, lo, hi, float(scale)) for (v, lo, hi, _), scale in zip(batch, scales))
+        print(f"Embedded {i + len(batch)} of {len(new_windows)} windows...")
+    matrix.flush()
+    del matrix
+
+    c.execute('DELETE FROM windows')
+    c.executemany('INSERT INTO windows (row, video_id, seq_lo, seq_hi, scale) VALUES (?,?,?,?,?)',
+                  [(row, *window) for row, window in enumerate(windows)])
+    c.execute('DELETE FROM videos')
+    c.executemany('INSERT INTO videos (video_id, hash) VALUES (?, ?)',
+                  [(v, videos[v][0]) for v in kept + changed])
+    for key, value in (('matrix', name), ('generation', generation), ('model', model_name),
+                       ('window_captions', WINDOW_CAPTIONS), ('dim', dim)):
+        c.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+    conn.commit()
+    conn.close()
+    remove_stale_matrices(vector_db_file, name)
+
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(matrix_path(vector_db_file, name))
+    print(f"Kept {len(kept)} unchanged videos, embedded {len(changed)}, removed {removed}.")
+    print(f"Vector index complete: {total} windows x {dim} dims, {size / 1024 / 1024:.1f} MB.")
+    if new_windows:
+        print(f"Throughput: {len(new_windows) / elapsed:.1f} windows/s ({elapsed:.1f}s).")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Embed caption windows of kunue_rii.db for semantic search (run after rebuild_db.py).")
+    parser.add_argument('--full', action='store_true', help="embed every video again")
+    parser.add_argument('--model', default=MODEL_NAME, help=f"sentence-transformers model (default: {MODEL_NAME})")
+    args = parser.parse_args()
+    try:
+        embed_database(full=args.full, model_name=args.model)
+    except ImportError as e:
+        print(f"Semantic search needs numpy and sentence-transformers ({e}).")
+        print("Install them with: pip install sentence-transformers")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,158 +2,892 @@ import os
 import sqlite3
 import re
 import glob
+import hashlib
+import argparse
+import time
+import unicodedata
+from collections import Counter, defaultdict, deque
+from functools import lru_cache
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor
+
+import textstore
+from vtt import iter_cues, normalize_cues, pack_word_times
 
 # Configuration
 DATA_DIR = r'd:/薫衣りぃ/RAG/字幕データ'
 DB_FILE = 'kunue_rii.db'
 
-def parse_timestamp(timestamp_str):
-    """Converts HH:MM:SS.mmm to seconds."""
-    try:
-        parts = timestamp_str.split(':')
-        hours = int(parts[0])
-        minutes = int(parts[1])
-        seconds = float(parts[2])
-        return hours * 3600 + minutes * 60 + seconds
-    except ValueError:
-        return 0
+# Bump this whenever parse_vtt() output or the index layout changes so that
+# an incremental update reindexes every video instead of trusting the manifest.
+INDEX_VERSION = 11
 
-def clean_text(text):
-    """Removes WebVTT tags and extra whitespace."""
-    # Remove tags like <00:00:00.199><c>...</c>
-    text = re.sub(r'<[^>]+>', '', text)
-    # Remove &nbsp; and other entities if any (though usually raw text)
-    text = text.replace('&nbsp;', ' ')
-    return text.strip()
+# When a video has several subtitle variants with identical contents, the
+# first matching suffix here is the one that gets parsed.
+VARIANT_PREFERENCE = ('.ja.vtt', '.ja-orig.vtt')
 
-def parse_vtt(file_path):
-    """Parses a VTT file and returns a list of (start_time, text) tuples."""
-    captions = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
-    current_start = None
-    current_text = []
-    
-    # Regex for timestamp line: 00:00:00.080 --> 00:00:02.430
-    timestamp_pattern = re.compile(r'(\d{2}:\d{2}:\d{2}\.\d{3}) -->')
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        
-        if line.startswith('WEBVTT') or line.startswith('Kind:') or line.startswith('Language:'):
+# A full rebuild is written to DB_FILE + TEMP_SUFFIX and renamed over DB_FILE
+# when complete. SWAP_SUFFIX marks the moment of the rename for the search
+# app, which lets go of the old file for up to SWAP_TIMEOUT seconds.
+TEMP_SUFFIX = '.tmp'
+SWAP_SUFFIX = '.swap'
+SWAP_TIMEOUT = 30
+
+# Characters taken from each side of a caption boundary for captions_joins.
+# A phrase split across two captions is found when neither part is longer.
+JOIN_CHARS = 8
+
+# A caption's id is (its video's `no` << SEQ_BITS) + seq, so the FTS
+# rowids of a search tell which video each hit is in without a lookup
+# (search_index.facets counts them per video that way). 16 bits allow
+# 65536 captions per video, ten times the longest stream so far, and keep
+# the ids small enough for short varints in the FTS indexes.
+SEQ_BITS = 16
+
+# Parsed videos buffered per worker between the parse pool and the writer.
+PARSE_QUEUE_DEPTH = 4
+
+# Watch mode (--watch): DATA_DIR is listed every POLL_SECONDS. A burst of
+# new files is indexed once nothing changed for DEBOUNCE_SECONDS, or at the
+# latest MAX_DEBOUNCE_SECONDS after its first file, so a long download
+# batch is still indexed as it goes. A failed update is retried after
+# DEBOUNCE_SECONDS, twice that on the next failure, and so on up to
+# MAX_DEBOUNCE_SECONDS, or as soon as the folder changes again.
+POLL_SECONDS = 2
+DEBOUNCE_SECONDS = 5
+MAX_DEBOUNCE_SECONDS = 60
+
+# Filename format: YYYYMMDD_TITLE_VIDEOID.ja.vtt (or .ja-orig.vtt)
+FILENAME_PATTERN = re.compile(r'_([a-zA-Z0-9_-]{11})\.ja(?:-orig)?\.vtt$')
+
+# Tags in video titles: 【原神】, 【ピグパ】, ... A bracket may hold several
+# hashtags, separated by a slash (⧸ once yt-dlp made the title a filename)
+# or by spaces.
+TAG_PATTERN = re.compile(r'【([^【】]+)】')
+TAG_SEPARATOR = re.compile(r'[⧸/]|\s+(?=#)')
+
+# Words for search suggestions: runs of katakana, of kanji, or of latin
+# letters and digits. Japanese has no spaces, but a change of script is a
+# fair guess at a word boundary, and these runs are what people search for.
+WORD_PATTERN = re.compile(r'[ァ-ヺ][ァ-ヺー]+|[々〆ヵヶ一-鿿]+|[0-9A-Za-z]{2,}')
+
+# Every substring of a run up to SUGGEST_SUBSTRING_CHARS characters is
+# counted in suggest_terms, so a word's count there is exactly the number
+# of captions a search for it finds, even in captions where it is only
+# part of a longer run. Longer words are counted where they stand whole;
+# runs longer than SUGGEST_WORD_CHARS are noise (ダダダダ...), only their
+# substrings are counted.
+SUGGEST_SUBSTRING_CHARS = 8
+SUGGEST_WORD_CHARS = 16
+
+def parse_filename(filename):
+    """Splits YYYYMMDD_TITLE_VIDEOID.ja.vtt into (video_id, date, title), or None."""
+    # Use regex to extract Video ID (11 chars) from the end
+    match = FILENAME_PATTERN.search(filename)
+    if not match:
+        return None
+    video_id = match.group(1)
+    # Date is the first 8 chars
+    date = filename[:8]
+    # Title is everything between Date_ and _VideoID
+    title = filename[9:match.start(1) - 1]
+    return video_id, date, title
+
+def title_tags(title):
+    """
+    The 【】 tags of a title in order, without duplicates and without the
+    # of hashtags: '【原神】召使【＃原神⧸#genshinimpact】' -> ['原神', 'genshinimpact'].
+    """
+    tags = []
+    for bracket in TAG_PATTERN.findall(unicodedata.normalize('NFKC', title)):
+        for tag in TAG_SEPARATOR.split(bracket):
+            tag = tag.strip().lstrip('#').strip()
+            if tag:
+                tags.append(tag)
+    return list(dict.fromkeys(tags))
+
+def text_words(text):
+    """The runs of WORD_PATTERN in a text, lowercased as the trigram index matches them."""
+    return [word.lower() for word in WORD_PATTERN.findall(text)]
+
+def title_words(title):
+    return {word for word in text_words(title) if len(word) <= SUGGEST_WORD_CHARS}
+
+@lru_cache(maxsize=65536)
+def word_substrings(word):
+    """A run's substrings of up to SUGGEST_SUBSTRING_CHARS characters, and the run unless it is too long."""
+    substrings = {word} if len(word) <= SUGGEST_WORD_CHARS else set()
+    for i in range(len(word)):
+        for j in range(i + 1, min(len(word), i + SUGGEST_SUBSTRING_CHARS) + 1):
+            substrings.add(word[i:j])
+    return frozenset(substrings)
+
+def term_counts(texts):
+    """
+    Counters of the captions containing each term and of the captions
+    where it is a whole word, over the caption texts.
+    """
+    captions = Counter()
+    words = Counter()
+    for text in texts:
+        found = set(text_words(text))
+        words.update(word for word in found if len(word) <= SUGGEST_WORD_CHARS)
+        captions.update(set().union(*map(word_substrings, found)))
+    return captions, words
+
+def count_terms(c, captions, words=None, titles=(), sign=1):
+    """Adds (sign=1) or takes back (sign=-1) term_counts() and title words in suggest_terms."""
+    words = words or {}
+    titles = Counter(titles)
+    terms = set(captions) | set(titles)
+    c.executemany('''
+        INSERT INTO suggest_terms (term, captions, words, titles) VALUES (?, ?, ?, ?)
+        ON CONFLICT (term) DO UPDATE SET captions = captions + excluded.captions,
+            words = words + excluded.words, titles = titles + excluded.titles
+    ''', [(term, sign * captions.get(term, 0), sign * words.get(term, 0), sign * titles[term])
+        for term in terms])
+    if sign < 0:
+        c.executemany('DELETE FROM suggest_terms WHERE term = ? AND captions <= 0 AND titles <= 0',
+                      [(term,) for term in terms])
+
+def scan_videos(data_dir):
+    """Returns {video_id: [file paths]} for every well-formed VTT file in data_dir."""
+    videos = defaultdict(list)
+    for file_path in sorted(glob.glob(os.path.join(data_dir, '*.vtt'))):
+        filename = os.path.basename(file_path)
+        parsed = parse_filename(filename)
+        if parsed is None:
+            print(f"Skipping malformed filename: {filename}")
             continue
+        videos[parsed[0]].append(file_path)
+    return videos
 
-        match = timestamp_pattern.match(line)
-        if match:
-            # If we have previous text, save it
-            if current_start is not None and current_text:
-                full_text = clean_text(" ".join(current_text))
-                if full_text:
-                    captions.append((current_start, full_text))
-            
-            current_start = parse_timestamp(match.group(1))
-            current_text = []
-        else:
-            # Append text line if we are inside a caption block
-            if current_start is not None:
-                # Skip lines that are just metadata or empty
-                if 'align:start' in line: # Sometimes metadata is on the same line or next
-                    continue
-                current_text.append(line)
-
-    # Add the last caption
-    if current_start is not None and current_text:
-        full_text = clean_text(" ".join(current_text))
-        if full_text:
-            captions.append((current_start, full_text))
-            
-    return captions
-
-def rebuild_database():
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-        print(f"Existing database {DB_FILE} removed.")
-
-    conn = sqlite3.connect(DB_FILE)
+def file_signature(paths):
+    """Cheap change check for a video's files: (joined paths, newest mtime, total size)."""
+    stats = [os.stat(p) for p in paths]
+    return (
+        os.pathsep.join(os.path.basename(p) for p in paths),
+        max(st.st_mtime for st in stats),
+        sum(st.st_size for st in stats),
+    )
+
+def file_hash(path):
+    """SHA-1 of a file's contents, used when mtime/size changed."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def variant_rank(path):
+    """Sort key preferring the first suffix in VARIANT_PREFERENCE."""
+    for rank, suffix in enumerate(VARIANT_PREFERENCE):
+        if path.endswith(suffix):
+            return rank
+    return len(VARIANT_PREFERENCE)
+
+def select_sources(paths, digests):
+    """
+    Picks which of a video's subtitle files to parse.
+
+    Files with identical contents are parsed once, from the preferred
+    variant. If the variants really differ, all distinct ones are kept and
+    parse_video() merges them. Returns (sources, skipped).
+    """
+    by_content = {}
+    for path, digest in sorted(zip(paths, digests), key=lambda pd: variant_rank(pd[0])):
+        by_content.setdefault(digest, path)
+    sources = list(by_content.values())
+    skipped = [path for path in paths if path not in sources]
+    return sources, skipped
+
+def char_tokens(text):
+    """Spaces out every character, so unicode61 indexes one character per token."""
+    return ' '.join(text)
+
+def connect(db_file):
+    """Opens the database for writing, with the SQL functions the index needs."""
+    conn = sqlite3.connect(db_file)
+    conn.create_function('char_tokens', 1, char_tokens, deterministic=True)
+    return conn
+
+def create_schema(conn):
     c = conn.cursor()
 
-    # Create FTS5 table with trigram tokenizer for better Japanese support
+    # no: the video's number, the high bits of its caption ids (see SEQ_BITS).
     c.execute('''
-    CREATE VIRTUAL TABLE subtitles USING fts5(
-        video_id,
-        date,
-        title,
+    CREATE TABLE IF NOT EXISTS videos (
+        id TEXT PRIMARY KEY,
+        date TEXT NOT NULL,
+        title TEXT NOT NULL,
+        no INTEGER NOT NULL UNIQUE
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS videos_date ON videos (date)')
+
+    # The title tags of each video (see title_tags), for the search app's
+    # facets.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS video_tags (
+        tag TEXT NOT NULL,
+        video_id TEXT NOT NULL,
+        PRIMARY KEY (tag, video_id)
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS video_tags_video ON video_tags (video_id)')
+
+    # seq: position of the caption within its video (0, 1, 2, ... in time
+    # order), so neighbouring captions are an index range.
+    # word_times: packed per-word timings of auto-captions (see
+    # vtt.pack_word_times), NULL for captions without them.
+    # The text is in caption_text.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS captions (
+        id INTEGER PRIMARY KEY,
+        video_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        start_ms INTEGER NOT NULL,
+        word_times BLOB
+    )
+    ''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS captions_video ON captions (video_id, seq)')
+
+    # Caption text, zlib-compressed in blocks of textstore.BLOCK_CAPTIONS
+    # captions of a video with the preset dictionary in meta 'text_dict'
+    # (see textstore.py). Only the blocks of a result page are read back.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS caption_text (
+        video_id TEXT NOT NULL,
+        block INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (video_id, block)
+    )
+    ''')
+
+    # Captions waiting to be compressed and indexed by index_staged(), with
+    # their text in the clear. Private to this connection.
+    c.execute('''
+    CREATE TEMP TABLE IF NOT EXISTS staged_text (
+        id INTEGER PRIMARY KEY,
+        video_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        text TEXT NOT NULL
+    )
+    ''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS temp.staged_text_video ON staged_text (video_id, seq)')
+
+    # Full-text index over the caption text. Trigram tokenizer for better
+    # Japanese support. Contentless: the text is in caption_text.
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS captions_fts USING fts5(
         text,
-        timestamp,
-        url,
+        content='',
         tokenize='trigram'
     )
     ''')
 
-    files = glob.glob(os.path.join(DATA_DIR, '*.vtt'))
-    print(f"Found {len(files)} VTT files.")
+    # Trigrams cannot match 1-2 character terms, so the same text is also
+    # indexed one character per token (see char_tokens). A short term is
+    # then an exact phrase query, e.g. 樹脂 -> "樹 脂". Contentless too.
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS captions_chars USING fts5(
+        text,
+        content='',
+        tokenize='unicode61 remove_diacritics 0'
+    )
+    ''')
+
+    # Phrases split across two rolling captions: the last JOIN_CHARS
+    # characters of each caption followed by the first JOIN_CHARS of the
+    # next one in the video (see join_windows_sql), under the rowid of the
+    # first caption. Contentless, and bounded to 2 * JOIN_CHARS characters
+    # per caption whatever the caption length.
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS captions_joins USING fts5(
+        text,
+        content='',
+        tokenize='trigram'
+    )
+    ''')
+
+    # One row per indexed video, used to decide what an incremental update
+    # has to touch. `path` lists every VTT file that fed the video.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS manifest (
+        video_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        row_count INTEGER NOT NULL
+    )
+    ''')
+
+    # Terms for search suggestions (search_index.suggest): the words of the
+    # captions and their substrings (see term_counts), with the number of
+    # captions containing the term, of captions where it is a whole word,
+    # and of video titles where it is a word. Sorted by term, so the terms
+    # with a given prefix are one range.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS suggest_terms (
+        term TEXT PRIMARY KEY,
+        captions INTEGER NOT NULL,
+        words INTEGER NOT NULL,
+        titles INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+    c.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+def get_meta(conn, key, default=None):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+def commit_generation(conn, generation):
+    """Commits with the generation counter moved on, so the search app drops its cached results."""
+    set_meta(conn, 'generation', generation)
+    conn.commit()
+
+def parse_video(paths):
+    """
+    Parses the selected files of one video into ((video_id, date, title),
+    [(start_ms, text, word_times), ...], number of raw VTT cues).
+
+    When more than one variant was selected their captions are merged: every
+    distinct (start_ms, text) pair is kept once, in time order.
+    """
+    video_id, date, title = parse_filename(os.path.basename(paths[0]))
+    captions = []
+    cue_count = 0
+    for file_path in paths:
+        cues = list(iter_cues(file_path, word_times=True))
+        cue_count += len(cues)
+        captions.extend((start_ms, text, pack_word_times(start_ms, words))
+                        for start_ms, text, words in normalize_cues(cues))
+    if len(paths) > 1:
+        merged = {}
+        for caption in captions:
+            merged.setdefault(caption[:2], caption)
+        captions = [merged[key] for key in sorted(merged)]
+    return (video_id, date, title), captions, cue_count
+
+def join_windows_sql(where=''):
+    """SELECT of (rowid, text) for captions_joins, over the staged captions matching `where`."""
+    return f'''
+        SELECT id, substr(text, -{JOIN_CHARS}) || substr(next_text, 1, {JOIN_CHARS}) FROM (
+            SELECT id, text, lead(text) OVER (PARTITION BY video_id ORDER BY seq) AS next_text
+            FROM staged_text {where}
+        )
+        WHERE next_text IS NOT NULL
+    '''
+
+def insert_captions(c, captions):
+    """
+    Adds captions [(video_id, seq, start_ms, text, word_times), ...] and
+    stages their text for index_staged(). Each video's captions must all be
+    staged before it is indexed. The videos must have been added with
+    add_video(), which numbers them.
+    """
+    numbers = {}
+    for video_id in {caption[0] for caption in captions}:
+        numbers[video_id] = c.execute('SELECT no FROM videos WHERE id = ?', (video_id,)).fetchone()[0]
+    if any(caption[1] >> SEQ_BITS for caption in captions):
+        raise ValueError(f"More than {1 << SEQ_BITS} captions in one video")
+    captions = [((numbers[caption[0]] << SEQ_BITS) + caption[1], *caption) for caption in captions]
+    c.executemany('INSERT INTO captions (id, video_id, seq, start_ms, word_times) VALUES (?,?,?,?,?)',
+                  [(id_, video_id, seq, start_ms, word_times)
+                   for id_, video_id, seq, start_ms, _, word_times in captions])
+    c.executemany('INSERT INTO staged_text (id, video_id, seq, text) VALUES (?,?,?,?)',
+                  [(id_, video_id, seq, text) for id_, video_id, seq, _, text, _ in captions])
+
+def index_staged(c):
+    """
+    Compresses the staged captions into caption_text, adds them to the FTS
+    indexes and the suggestion terms, and clears the staging table.
+
+    The dictionary is made from a sample of the first captions ever
+    indexed, so a full build samples the whole corpus.
+    """
+    conn = c.connection
+    staged = conn.execute('SELECT count(*) FROM staged_text').fetchone()[0]
+    if not staged:
+        return
+    zdict = textstore.load_dictionary(conn)
+    if zdict is None:
+        step = max(1, staged // textstore.DICT_SAMPLE)
+        sample = [row[0] for row in conn.execute(
+            'SELECT text FROM (SELECT text, row_number() OVER (ORDER BY id) AS n FROM staged_text) WHERE n % ? = 0',
+            (step,))]
+        zdict = textstore.train_dictionary(sample)
+        set_meta(conn, 'text_dict', zdict)
+
+    rows = conn.execute('SELECT video_id, seq, text FROM staged_text ORDER BY video_id, seq')
+    c.executemany('INSERT INTO caption_text (video_id, block, data) VALUES (?,?,?)', (
+        (video_id, block, textstore.compress_block([row[2] for row in block_rows], zdict))
+        for (video_id, block), block_rows in groupby(
+            rows, key=lambda row: (row[0], row[1] // textstore.BLOCK_CAPTIONS))))
+
+    c.execute('INSERT INTO captions_fts (rowid, text) SELECT id, text FROM staged_text')
+    c.execute('INSERT INTO captions_chars (rowid, text) SELECT id, char_tokens(text) FROM staged_text')
+    c.execute('INSERT INTO captions_joins (rowid, text) ' + join_windows_sql())
+    count_terms(c, *term_counts(row[0] for row in conn.execute('SELECT text FROM staged_text')))
+    c.execute('DELETE FROM staged_text')
+
+def add_video(c, video):
+    """Adds or updates the (video_id, date, title) row of a video, its title tags and title words."""
+    old = c.execute('SELECT title FROM videos WHERE id = ?', (video[0],)).fetchone()
+    if old:
+        count_terms(c, {}, titles=title_words(old[0]), sign=-1)
+    count_terms(c, {}, titles=title_words(video[2]))
+    c.execute('''
+        INSERT INTO videos (id, date, title, no)
+        VALUES (?, ?, ?, (SELECT COALESCE(MAX(no), 0) + 1 FROM videos))
+        ON CONFLICT (id) DO UPDATE SET date = excluded.date, title = excluded.title
+    ''', video)
+    c.execute('DELETE FROM video_tags WHERE video_id = ?', (video[0],))
+    c.executemany('INSERT INTO video_tags (tag, video_id) VALUES (?, ?)',
+                  [(tag, video[0]) for tag in title_tags(video[2])])
+
+def insert_video(c, video, captions, index=True):
+    """
+    Adds one video and its captions to the tables and the FTS indexes.
+
+    Bulk loads pass index=False and call build_fts() once at the end instead.
+    """
+    video_id = video[0]
+    add_video(c, video)
+    insert_captions(c, [(video_id, seq, *caption) for seq, caption in enumerate(captions)])
+    if index:
+        index_staged(c)
+
+def delete_video(c, video_id):
+    """Removes a video, its captions, their text, their FTS entries and their suggestion terms."""
+    # Contentless FTS5 tables need the old values to delete an entry, so the
+    # video's text is staged again from caption_text first.
+    texts = textstore.video_texts(c.connection, video_id)
+    captions = c.execute('SELECT id, seq FROM captions WHERE video_id = ?', (video_id,)).fetchall()
+    c.executemany('INSERT INTO staged_text (id, video_id, seq, text) VALUES (?,?,?,?)',
+                  [(id_, video_id, seq, texts[seq]) for id_, seq in captions])
+    c.execute('''
+        INSERT INTO captions_fts (captions_fts, rowid, text)
+        SELECT 'delete', id, text FROM staged_text WHERE video_id = ?
+    ''', (video_id,))
+    c.execute('''
+        INSERT INTO captions_chars (captions_chars, rowid, text)
+        SELECT 'delete', id, char_tokens(text) FROM staged_text WHERE video_id = ?
+    ''', (video_id,))
+    c.execute("INSERT INTO captions_joins (captions_joins, rowid, text) SELECT 'delete', * FROM ("
+              + join_windows_sql('WHERE video_id = ?') + ")", (video_id,))
+    title = c.execute('SELECT title FROM videos WHERE id = ?', (video_id,)).fetchone()
+    count_terms(c, *term_counts(texts), titles=title_words(title[0]) if title else (), sign=-1)
+    c.execute('DELETE FROM staged_text WHERE video_id = ?', (video_id,))
+    c.execute('DELETE FROM caption_text WHERE video_id = ?', (video_id,))
+    c.execute('DELETE FROM captions WHERE video_id = ?', (video_id,))
+    c.execute('DELETE FROM video_tags WHERE video_id = ?', (video_id,))
+    c.execute('DELETE FROM videos WHERE id = ?', (video_id,))
+
+def build_fts(c):
+    """Compresses and indexes every staged caption in one pass and merges each FTS index into a single segment."""
+    index_staged(c)
+    for table in ('captions_fts', 'captions_chars', 'captions_joins'):
+        c.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+def index_bytes(c, table):
+    """Bytes used by an FTS5 table's shadow tables, None if SQLite lacks dbstat."""
+    try:
+        return c.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE ? || '\\_%' ESCAPE '\\'",
+                         (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def read_generation(db_file):
+    """The generation counter of an existing database, 0 if there is none."""
+    if not os.path.exists(db_file):
+        return 0
+    conn = sqlite3.connect(db_file)
+    try:
+        return int(get_meta(conn, 'generation', 0))
+    except sqlite3.Error:
+        return 0
+    finally:
+        conn.close()
+
+def open_bulk_build(db_file):
+    """
+    Starts a from-scratch build next to db_file, returning (conn, temp path).
+
+    The temp file is written without a journal or fsyncs: if the build
+    fails it is simply thrown away, and the live database is never touched.
+    """
+    tmp_file = db_file + TEMP_SUFFIX
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = connect(tmp_file)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    create_schema(conn)
+    return conn, tmp_file
+
+def finish_bulk_build(conn, tmp_file, db_file):
+    """Closes a bulk build and moves it over db_file with replace_database()."""
+    conn.commit()
+    # Merging the FTS segments leaves free pages behind; a second or so of
+    # VACUUM hands them back.
+    conn.execute('VACUUM')
+    # WAL lets incremental updates write while the search app reads.
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+    replace_database(tmp_file, db_file)
+
+def replace_database(tmp_file, db_file):
+    """
+    Atomically renames tmp_file over db_file.
+
+    The search app keeps answering from the old file until the rename. A
+    SWAP_SUFFIX marker is created first: search_index.py sees it and stops
+    holding the old file open between queries, because Windows refuses to
+    rename over an open file. The rename is retried for SWAP_TIMEOUT
+    seconds. The old file's WAL is checkpointed and truncated first, so
+    none of its frames can be replayed into the new file.
+    """
+    marker = db_file + SWAP_SUFFIX
+    open(marker, 'w').close()
+    try:
+        if os.path.exists(db_file + '-wal'):
+            conn = sqlite3.connect(db_file)
+            try:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                conn.close()
+
+        deadline = time.monotonic() + SWAP_TIMEOUT
+        while True:
+            try:
+                os.replace(tmp_file, db_file)
+                return
+            except PermissionError:
+                if time.monotonic() > deadline:
+                    print(f"Could not replace {db_file}: it is still open. "
+                          f"The new database was left at {tmp_file}.")
+                    raise
+                time.sleep(0.2)
+    finally:
+        os.remove(marker)
+
+def clear_index(c):
+    """
+    Drops every table filled from the VTT files and creates them again, so
+    that reindexing also brings the table layout up to date.
+    """
+    for table in ('captions_fts', 'captions_chars', 'captions_joins', 'captions', 'caption_text',
+                  'videos', 'video_tags', 'suggest_terms', 'manifest'):
+        c.execute(f'DROP TABLE IF EXISTS {table}')
+    c.execute("DELETE FROM meta WHERE key = 'text_dict'")
+    create_schema(c.connection)
+
+def parse_videos(jobs, workers=1):
+    """
+    Yields (job, parse_video() result, error) for every job in order.
+
+    With workers > 1 the files are parsed in a process pool. At most
+    PARSE_QUEUE_DEPTH results per worker are kept in flight, so a slow
+    writer holds back the parsers instead of buffering the whole corpus.
+    Results come back in submission order, so the database ends up exactly
+    as a serial build would leave it.
+    """
+    if workers <= 1:
+        for job in jobs:
+            try:
+                yield job, parse_video(job[1]), None
+            except Exception as e:
+                yield job, None, e
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        jobs = iter(jobs)
+        while True:
+            for job in jobs:
+                pending.append((job, pool.submit(parse_video, job[1])))
+                if len(pending) >= workers * PARSE_QUEUE_DEPTH:
+                    break
+            if not pending:
+                return
+            job, future = pending.popleft()
+            try:
+                yield job, future.result(), None
+            except Exception as e:
+                yield job, None, e
+
+def rebuild_database(full=False, data_dir=None, db_file=None, workers=1, per_video=False):
+    """
+    Brings the database in line with the VTT files in data_dir.
+
+    By default only new, changed or deleted videos are (re)indexed, using the
+    manifest table. With full=True the database is dropped and rebuilt.
+    workers > 1 parses VTT files in that many processes; the inserts stay
+    on this process's single connection.
+
+    A full rebuild is bulk-loaded into a temp file that replaces db_file
+    when it is complete; an incremental update writes to db_file in place.
+    Either way it is a single transaction, unless per_video=True: then an
+    incremental update commits each video on its own (watch mode), so no
+    write transaction lasts longer than one video. A reindex of everything
+    stays a single transaction.
+    """
+    data_dir = data_dir or DATA_DIR
+    db_file = db_file or DB_FILE
+    generation = read_generation(db_file)
+
+    if full:
+        conn, tmp_file = open_bulk_build(db_file)
+    else:
+        conn = connect(db_file)
+        conn.execute('PRAGMA journal_mode = WAL')
+    # The sqlite3 module only opens a transaction by itself before DML; begin
+    # it here so that schema changes are part of the same transaction.
+    conn.execute('BEGIN')
+    c = conn.cursor()
+
+    has_subtitles = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'subtitles'").fetchone()
+    create_schema(conn)
+
+    manifest = {
+        row[0]: row[1:] for row in
+        c.execute('SELECT video_id, path, mtime, size, hash, row_count FROM manifest')
+    }
+    reindex_reason = None
+    if has_subtitles:
+        # Single-table layout from before the videos/captions split.
+        reindex_reason = "Database uses the old subtitles table"
+        c.execute('DROP TABLE subtitles')
+    elif not manifest and c.execute('SELECT 1 FROM captions LIMIT 1').fetchone():
+        # Built by create_db.py: nothing in it can be attributed to a file.
+        reindex_reason = "Database has no manifest yet"
+    elif manifest and get_meta(conn, 'index_version') != INDEX_VERSION:
+        reindex_reason = "Parser or index layout changed"
+    if reindex_reason:
+        print(f"{reindex_reason}; reindexing all videos.")
+        manifest = {}
+        clear_index(c)
+    # A build from nothing indexes everything at the end, so the text
+    # dictionary is trained on the whole corpus (see index_staged).
+    bulk = full or not manifest
+    per_video = per_video and not bulk
+
+    videos = scan_videos(data_dir)
+    print(f"Found {sum(len(p) for p in videos.values())} VTT files "
+          f"for {len(videos)} videos.")
 
-    batch_data = []
     count = 0
+    skipped = reindexed = removed = 0
+    variants_skipped = 0
 
-    for file_path in files:
-        filename = os.path.basename(file_path)
-        
+    for video_id in sorted(set(manifest) - set(videos)):
+        delete_video(c, video_id)
+        c.execute('DELETE FROM manifest WHERE video_id = ?', (video_id,))
+        removed += 1
+        if per_video:
+            generation += 1
+            commit_generation(conn, generation)
+
+    # Work out what needs parsing first, so the parse step can run ahead
+    # of the writer in a process pool.
+    jobs = []
+    for video_id, paths in videos.items():
         try:
-            # Parse filename: YYYYMMDD_TITLE_VIDEOID.ja.vtt
-            # Use regex to extract Video ID (11 chars) from the end
-            match = re.search(r'_([a-zA-Z0-9_-]{11})\.ja(?:-orig)?\.vtt$', filename)
-            if match:
-                video_id = match.group(1)
-                # Date is the first 8 chars
-                date = filename[:8]
-                # Title is everything between Date_ and _VideoID
-                video_id_start_index = match.start(1)
-                title = filename[9:video_id_start_index-1]
-            else:
-                print(f"Skipping malformed filename: {filename}")
+            path, mtime, size = file_signature(paths)
+            old = manifest.get(video_id)
+            if old and old[:3] == (path, mtime, size):
+                skipped += 1
+                continue
+
+            digests = [file_hash(p) for p in paths]
+            digest = hashlib.sha1(''.join(digests).encode()).hexdigest()
+            if old and old[0] == path and old[3] == digest:
+                # Touched but not modified: just remember the new mtime.
+                c.execute('UPDATE manifest SET mtime = ?, size = ? WHERE video_id = ?',
+                          (mtime, size, video_id))
+                skipped += 1
                 continue
-            
-            captions = parse_vtt(file_path)
-            
-            for start_seconds, text in captions:
-                # Format timestamp for display (HH:MM:SS)
-                m, s = divmod(int(start_seconds), 60)
-                h, m = divmod(m, 60)
-                timestamp_display = f"{h:02d}:{m:02d}:{s:02d}"
-                
-                # Create URL with timestamp
-                url = f"https://www.youtube.com/watch?v={video_id}&t={int(start_seconds)}s"
-                
-                batch_data.append((
-                    video_id,
-                    date,
-                    title,
-                    text,
-                    timestamp_display,
-                    url
-                ))
-                count += 1
-                
-                if len(batch_data) >= 10000:
-                    c.executemany('INSERT INTO subtitles VALUES (?,?,?,?,?,?)', batch_data)
-                    conn.commit()
-                    batch_data = []
-                    print(f"Processed {count} lines...")
+
+            sources, skipped_variants = select_sources(paths, digests)
+            for variant in skipped_variants:
+                print(f"Skipping duplicate variant: {os.path.basename(variant)}")
+            variants_skipped += len(skipped_variants)
+            if len(sources) > 1:
+                print(f"Merging differing variants of {video_id}: "
+                      f"{', '.join(os.path.basename(p) for p in sources)}")
+
+            jobs.append((video_id, sources, (video_id, path, mtime, size, digest), old))
 
         except Exception as e:
-            print(f"Error processing {filename}: {e}")
+            print(f"Error processing {video_id}: {e}")
             continue
 
-    if batch_data:
-        c.executemany('INSERT INTO subtitles VALUES (?,?,?,?,?,?)', batch_data)
+    started = time.perf_counter()
+    parsed_files = 0
+    cue_total = 0
+
+    for (video_id, paths, entry, old), parsed, error in parse_videos(jobs, workers):
+        if error is not None:
+            print(f"Error processing {video_id}: {error}")
+            continue
+        video, captions, cue_count = parsed
+
+        if old:
+            delete_video(c, video_id)
+        insert_video(c, video, captions, index=not bulk)
+        c.execute('INSERT OR REPLACE INTO manifest VALUES (?,?,?,?,?,?)',
+                  entry + (len(captions),))
+
+        if per_video:
+            generation += 1
+            commit_generation(conn, generation)
+
+        count += len(captions)
+        cue_total += cue_count
+        parsed_files += len(paths)
+        reindexed += 1
+        if reindexed % 50 == 0:
+            print(f"Processed {count} lines...")
+
+    if bulk:
+        print("Building search indexes...")
+        build_fts(c)
+
+    # Everything goes in as one transaction, so the search app keeps seeing
+    # the previous state of the index until the update is complete. The
+    # generation keeps counting across full rebuilds, so the app's result
+    # cache notices the new file.
+    set_meta(conn, 'index_version', INDEX_VERSION)
+    commit_generation(conn, generation + 1)
+
+    elapsed = time.perf_counter() - started
+    total = c.execute('SELECT COALESCE(SUM(row_count), 0) FROM manifest').fetchone()[0]
+    print(f"Skipped {skipped} unchanged videos, reindexed {reindexed}, removed {removed}.")
+    if variants_skipped:
+        print(f"Skipped {variants_skipped} duplicate subtitle variants.")
+    print(f"Database rebuild complete. {count} lines indexed, total {total} lines.")
+    if cue_total:
+        print(f"Collapsed {cue_total} VTT cues into {count} lines "
+              f"({100 - 100 * count / cue_total:.0f}% fewer rows).")
+    timed, word_bytes = c.execute(
+        'SELECT COUNT(word_times), COALESCE(SUM(length(word_times)), 0) FROM captions').fetchone()
+    print(f"Word timings: {word_bytes / 1024 / 1024:.1f} MB for {timed} of {total} lines.")
+    blocks, text_bytes = c.execute(
+        'SELECT count(*), COALESCE(SUM(length(data)), 0) FROM caption_text').fetchone()
+    print(f"Caption text: {text_bytes / 1024 / 1024:.1f} MB compressed in {blocks} blocks.")
+    terms, words = c.execute(
+        'SELECT count(*), COALESCE(SUM(words > 1 OR titles > 0), 0) FROM suggest_terms').fetchone()
+    print(f"Suggestions: {words} words ({terms} terms counted).")
+    fts_bytes, joins_bytes = index_bytes(c, 'captions_fts'), index_bytes(c, 'captions_joins')
+    if fts_bytes and joins_bytes:
+        print(f"Caption boundary index: {joins_bytes / 1024 / 1024:.1f} MB "
+              f"({100 * joins_bytes / fts_bytes:.0f}% of the caption index).")
+    if full:
+        finish_bulk_build(conn, tmp_file, db_file)
+    else:
+        conn.close()
+    print(f"Database size: {os.path.getsize(db_file) / 1024 / 1024:.1f} MB")
+    if parsed_files:
+        print(f"Throughput: {parsed_files / elapsed:.1f} files/s, {count / elapsed:.0f} rows/s "
+              f"({workers} worker{'s' if workers > 1 else ''}, {elapsed:.1f}s).")
+
+def snapshot(data_dir):
+    """{file name: (mtime, size)} of the VTT files in data_dir."""
+    files = {}
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.vtt') and entry.is_file():
+                st = entry.stat()
+                files[entry.name] = (st.st_mtime, st.st_size)
+    return files
+
+def record_ingest(db_file, lag):
+    """Stores when the last change was indexed and how long after it landed (meta ingested_at, ingest_lag)."""
+    conn = connect(db_file)
+    try:
+        set_meta(conn, 'ingested_at', time.time())
+        set_meta(conn, 'ingest_lag', lag)
         conn.commit()
+    finally:
+        conn.close()
 
-    print(f"Database rebuild complete. Total {count} lines indexed.")
-    conn.close()
+def watch(data_dir=None, db_file=None, workers=1):
+    """
+    Indexes new, changed and deleted VTT files as they land, until Ctrl+C.
+
+    The folder is polled (portable, and cheap at a few thousand files)
+    and every update is incremental with one transaction per video (see
+    rebuild_database), so the search app keeps answering from the WAL
+    while videos are added. Ingest lag, from a file landing to its video
+    being searchable, is printed and stored in the meta table.
+    """
+    data_dir = data_dir or DATA_DIR
+    db_file = db_file or DB_FILE
+    rebuild_database(data_dir=data_dir, db_file=db_file, workers=workers, per_video=True)
+    indexed = seen = snapshot(data_dir)
+    print(f"Watching {data_dir} for new or changed VTT files (Ctrl+C to stop)...")
+
+    landed = last_change = retry_at = None
+    failures = 0
+    try:
+        while True:
+            time.sleep(POLL_SECONDS)
+            current = snapshot(data_dir)
+            now = time.time()
+            if current != seen:
+                seen, last_change, retry_at = current, now, None
+                if landed is None:
+                    # A file landed between the previous poll and now; its
+                    # mtime says when, unless the downloader kept an older one.
+                    mtimes = [st[0] for name, st in current.items() if indexed.get(name) != st]
+                    landed = min(now, max(mtimes + [now - POLL_SECONDS]))
+            if landed is None:
+                continue
+            if retry_at is not None:
+                if now < retry_at:
+                    continue
+            elif now - last_change < DEBOUNCE_SECONDS and now - landed < MAX_DEBOUNCE_SECONDS:
+                continue
+
+            try:
+                rebuild_database(data_dir=data_dir, db_file=db_file, workers=workers, per_video=True)
+            except Exception as e:
+                # Back off (up to MAX_DEBOUNCE_SECONDS) while the failure lasts;
+                # landed is kept, so the lag still counts from the first file.
+                failures += 1
+                delay = min(DEBOUNCE_SECONDS * 2 ** (failures - 1), MAX_DEBOUNCE_SECONDS)
+                print(f"Update failed, retrying after the next change or in {delay}s: {e}")
+                retry_at = time.time() + delay
+                continue
+            lag = time.time() - landed
+            record_ingest(db_file, lag)
+            print(f"Ingest lag: {lag:.1f}s.")
+            indexed, landed, retry_at, failures = current, None, None, 0
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the subtitle VTT files into kunue_rii.db.")
+    parser.add_argument('--full', action='store_true',
+                        help="drop the database and rebuild it from scratch")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="parse VTT files in N processes (default: 1)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and index VTT files as they are added or changed")
+    args = parser.parse_args()
+    if args.watch:
+        watch(workers=args.workers)
+    else:
+        rebuild_database(full=args.full, workers=args.workers)
 
 if __name__ == "__main__":
-    rebuild_database()
+    main()
@@ -0,0 +1,4 @@
+@echo off
+cd /d "d:\薫衣りぃ\RAG"
+python search_api.py
+pause
@@ -0,0 +1,313 @@
+"""
+Read-only JSON search API over the database, for scripts and the Discord
+tools. Run from the RAG directory next to the app:
+
+    python search_api.py --port 8502
+
+GET /api/search?q=...   One page of search results. Optional parameters:
+                        order (see search_index.ORDERS), limit, spans (0/1),
+                        cursor (next_cursor of the previous page) and the
+                        filters date_from, date_to, video_id, month, tag.
+GET /api/facets?q=...   Hit counts per video, month and title tag.
+GET /api/suggest?q=...  Completions of the last term of q with their hit
+                        counts, answered from memory (fast enough to call
+                        on every keystroke). Optional: limit.
+GET /api/videos         All indexed videos, newest first.
+GET /metrics            Request counts and latency histograms, in the
+                        Prometheus text format.
+
+Every API response carries the database generation (see rebuild_db.py) as
+its ETag. A client that repeats a request with If-None-Match gets 304 Not
+Modified without any query being run, until the index changes.
+
+Each request is served on its own thread, and its queries run on a
+connection of search_index.py's pool, so at most POOL_SIZE queries run at
+once and the rest wait for a free connection.
+"""
+import os
+import json
+import time
+import base64
+import bisect
+import sqlite3
+import argparse
+import threading
+from collections import defaultdict
+
+from flask import Flask, request, jsonify, g
+from werkzeug.exceptions import HTTPException
+
+import search_index
+import vector_index
+
+# Results per page when the request gives no limit, and the most it may ask for.
+DEFAULT_LIMIT = search_index.PAGE_SIZE
+MAX_LIMIT = 500
+
+# The most suggestions /api/suggest may ask for.
+MAX_SUGGESTIONS = 50
+
+# Upper bounds (seconds) of the latency histogram buckets in /metrics.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Filters passed through to search_index, as query parameters of the same name.
+FILTERS = ('date_from', 'date_to', 'video_id', 'month', 'tag')
+
+# Items in a search_index cursor for each keyword order: (date, video_id,
+# start_ms, id) for 'date', (score, id) otherwise. 'hybrid' uses an offset.
+CURSOR_ITEMS = {'date': 4, 'relevance': 2, 'recent': 2}
+
+app = Flask(__name__)
+app.json.ensure_ascii = False
+
+_metrics_lock = threading.Lock()
+_latency_counts = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+_latency_sums = defaultdict(float)
+_responses = defaultdict(int)
+
+class InvalidParameter(ValueError):
+    """A request parameter that cannot be used; answered with 400."""
+
+def encode_cursor(cursor):
+    """A search_index cursor (a tuple, or an offset for 'hybrid') as an opaque URL-safe string."""
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(text, order):
+    """The search_index cursor in text, checked to be one that order returns."""
+    if not text:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(text + '=' * (-len(text) % 4)))
+    except ValueError:
+        raise InvalidParameter('invalid cursor')
+    if order == 'hybrid':
+        if type(value) is not int or value < 0:
+            raise InvalidParameter('invalid cursor')
+        return value
+    if (not isinstance(value, list) or len(value) != CURSOR_ITEMS[order]
+            or not all(type(item) in (str, int, float) for item in value)):
+        raise InvalidParameter('invalid cursor')
+    return tuple(value)
+
+def search_params():
+    """(query, filters, spans) from the request's query string."""
+    query = search_index.normalize_query(request.args.get('q', ''))
+    if not query:
+        raise InvalidParameter('q is required')
+    filters = {name: request.args[name] for name in FILTERS if request.args.get(name)}
+    spans = request.args.get('spans', '1') not in ('0', 'false')
+    return query, filters, spans
+
+def current_etag(order=None):
+    """
+    The ETag of every response until the index changes: the generation,
+    and for 'hybrid' also the version of the vector index of embed_db.py.
+    """
+    generation = search_index.generation()
+    if generation is None:
+        return None
+    if order == 'hybrid':
+        return f'{generation}-{os.stat(vector_index.VECTOR_DB_FILE).st_mtime_ns}'
+    return str(generation)
+
+def conditional(answer, order=None):
+    """
+    Answers with 304 when the client already has the current version,
+    otherwise with answer() as JSON, tagged with the current ETag.
+    """
+    etag = current_etag(order)
+    if etag is not None and etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(answer())
+    if etag is not None:
+        response.set_etag(etag)
+        # Clients may keep responses, but must check the ETag before reusing them.
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.errorhandler(InvalidParameter)
+def bad_request(e):
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(Exception)
+def server_error(e):
+    if isinstance(e, HTTPException):
+        return e
+    print(f"Error: {e}")
+    return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search')
+def api_search():
+    query, filters, spans = search_params()
+    order = request.args.get('order', 'date')
+    if order not in search_index.ORDERS:
+        raise InvalidParameter(f'order must be one of {", ".join(search_index.ORDERS)}')
+    if order == 'hybrid' and not vector_index.available():
+        raise InvalidParameter('order=hybrid needs the vector index of embed_db.py')
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise InvalidParameter('limit must be a number')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise InvalidParameter(f'limit must be between 1 and {MAX_LIMIT}')
+    cursor = decode_cursor(request.args.get('cursor'), order)
+
+    def answer():
+        rows, next_cursor = search_index.search(query, filters, order, cursor, limit, spans)
+        results = []
+        for row in rows:
+            # The time the query was said, where word timings allow
+            match_ms = search_index.match_ms(query, row['text'], row['start_ms'], row['word_times'])
+            results.append({
+                'video_id': row['video_id'],
+                'date': row['date'],
+                'title': row['title'],
+                'text': row['text'],
+                'start_ms': row['start_ms'],
+                'match_ms': match_ms,
+                'url': f"https://www.youtube.com/watch?v={row['video_id']}&t={match_ms // 1000}s",
+                'score': row['score'],
+            })
+        result = {'query': query, 'order': order, 'results': results,
+                  'next_cursor': encode_cursor(next_cursor)}
+        if cursor is None:
+            # Totals on the first page only; later pages are the same search.
+            matches, videos = search_index.count(query, filters, spans)
+            result['total'] = {'matches': matches, 'videos': videos}
+        return result
+
+    return conditional(answer, order)
+
+@app.route('/api/facets')
+def api_facets():
+    query, filters, spans = search_params()
+
+    def answer():
+        facets = search_index.facets(query, filters, spans)
+        return {
+            'query': query,
+            'videos': facets['videos'],
+            'months': {month: {'matches': hits, 'videos': videos}
+                       for month, (hits, videos) in facets['months'].items()},
+            'tags': {tag: {'matches': hits, 'videos': videos}
+                     for tag, (hits, videos) in facets['tags'].items()},
+        }
+
+    return conditional(answer)
+
+@app.route('/api/suggest')
+def api_suggest():
+    query = search_index.normalize_query(request.args.get('q', ''))
+    if not query:
+        raise InvalidParameter('q is required')
+    try:
+        limit = int(request.args.get('limit', search_index.SUGGESTIONS))
+    except ValueError:
+        raise InvalidParameter('limit must be a number')
+    if not 1 <= limit <= MAX_SUGGESTIONS:
+        raise InvalidParameter(f'limit must be between 1 and {MAX_SUGGESTIONS}')
+
+    def answer():
+        head = query.split()[:-1]
+        return {'query': query, 'suggestions': [
+            {'term': term, 'hits': hits, 'query': ' '.join(head + [term])}
+            for term, hits in search_index.suggest(query, limit)]}
+
+    return conditional(answer)
+
+@app.route('/api/videos')
+def api_videos():
+    return conditional(lambda: {'videos': [{'video_id': video_id, 'date': date, 'title': title}
+                                           for video_id, date, title in search_index.list_videos()]})
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Counts the response and adds its time to the latency histogram of its endpoint."""
+    if request.endpoint == 'metrics' or 'started' not in g:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    elapsed = time.perf_counter() - g.started
+    with _metrics_lock:
+        _latency_counts[endpoint][bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        _latency_sums[endpoint] += elapsed
+        _responses[endpoint, response.status_code] += 1
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """The request metrics, plus the state of the index and of the connection pool."""
+    lines = [
+        '# HELP search_api_request_seconds Time to answer a request.',
+        '# TYPE search_api_request_seconds histogram',
+    ]
+    with _metrics_lock:
+        latency = {endpoint: (list(counts), _latency_sums[endpoint])
+                   for endpoint, counts in _latency_counts.items()}
+        responses = dict(_responses)
+    for endpoint, (counts, total) in sorted(latency.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'search_api_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+        lines.append(f'search_api_request_seconds_sum{{endpoint="{endpoint}"}} {total:.6f}')
+        lines.append(f'search_api_request_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+
+    lines += [
+        '# HELP search_api_responses_total Responses sent, by endpoint and status (304 = answered from the ETag).',
+        '# TYPE search_api_responses_total counter',
+    ]
+    for (endpoint, status), count in sorted(responses.items()):
+        lines.append(f'search_api_responses_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+    connections_open, connections_idle = search_index.pool_status()
+    lines += [
+        '# HELP search_index_connections Read connections open in the pool, and how many are idle.',
+        '# TYPE search_index_connections gauge',
+        f'search_index_connections{{state="open"}} {connections_open}',
+        f'search_index_connections{{state="idle"}} {connections_idle}',
+    ]
+    try:
+        generation = search_index.generation()
+        ingest_status = search_index.ingest_status()
+    except (OSError, sqlite3.Error):
+        # No database yet (before the first build): leave out the index gauges.
+        generation = ingest_status = None
+    if generation is not None:
+        lines += [
+            '# HELP search_index_generation Generation counter of the database, moved on by every reindex.',
+            '# TYPE search_index_generation gauge',
+            f'search_index_generation {generation}',
+        ]
+    if ingest_status:
+        ingested_at, lag = ingest_status
+        lines += [
+            '# HELP search_index_ingested_at Unix time of the last change indexed by rebuild_db.py --watch.',
+            '# TYPE search_index_ingested_at gauge',
+            f'search_index_ingested_at {ingested_at:.3f}',
+            '# HELP search_index_ingest_lag_seconds Seconds from a subtitle file changing to it being searchable.',
+            '# TYPE search_index_ingest_lag_seconds gauge',
+            f'search_index_ingest_lag_seconds {lag:.3f}',
+        ]
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a read-only JSON search API over the database.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: this PC only)")
+    parser.add_argument('--port', type=int, default=8502, help="port to listen on")
+    parser.add_argument('--db', default=search_index.DB_FILE, help="database file")
+    args = parser.parse_args()
+
+    search_index.DB_FILE = args.db
+    # Load the suggestion terms now rather than on the first /api/suggest.
+    search_index.preload_suggestions()
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
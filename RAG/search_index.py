@@ -0,0 +1,898 @@
+import os
+import heapq
+import bisect
+import sqlite3
+import threading
+import urllib.request
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import textstore
+from vtt import unpack_word_times
+
+# Configuration
+DB_FILE = 'kunue_rii.db'
+
+# Number of query results kept in memory. Each entry is at most one
+# result list, so this bounds the cache to a few MB.
+RESULT_CACHE_SIZE = 256
+
+# Decompressed caption text blocks kept in memory (see textstore.py), a
+# few KB each. A page usually needs one block per video on it.
+TEXT_CACHE_SIZE = 1024
+
+# Read connection tuning: map the database into memory and keep a large
+# page cache, so repeated queries are served without touching the disk.
+MMAP_SIZE = 512 * 1024 * 1024
+CACHE_SIZE_KIB = 128 * 1024
+
+# Read connections kept open. Each query runs on a connection of its own,
+# so searches from several threads (Streamlit sessions, search_api.py) run
+# at the same time; a query waits while all of them are busy.
+POOL_SIZE = 4
+
+# Terms up to this many characters are looked up in captions_chars, since
+# the trigram index needs at least 3 characters.
+SHORT_TERM_MAX = 2
+
+# Created by rebuild_db.py while it swaps in a rebuilt database file.
+SWAP_SUFFIX = '.swap'
+
+# Caption ids are (video no << SEQ_BITS) + seq, as written by rebuild_db.py.
+SEQ_BITS = 16
+
+# Results per page.
+PAGE_SIZE = 50
+
+# Result orders accepted by search(). 'hybrid' needs the vector index of
+# embed_db.py (see vector_index.available()).
+ORDERS = ('date', 'relevance', 'recent', 'hybrid')
+
+# For order='recent': bm25 is divided by (1 + RECENCY_DECAY * age in years),
+# so a year-old match needs a 1.5x better text score to rank level.
+RECENCY_DECAY = 0.5
+
+# For order='hybrid': the best HYBRID_CANDIDATES keyword hits and as many
+# windows from vector_index.py are fused by reciprocal rank: a window scores
+# 1 / (HYBRID_RRF_K + rank) from each list it appears in.
+HYBRID_CANDIDATES = 200
+HYBRID_RRF_K = 60
+
+# Suggestions offered by suggest(), and how often a term must stand as a
+# whole word in the captions to be one (a word of a title always is).
+SUGGESTIONS = 8
+SUGGEST_MIN_WORDS = 2
+
+# Rolling captions cut words anywhere, so fragments like スターダ pass
+# SUGGEST_MIN_WORDS too. A term is left out when a longer term starting
+# with it is found in at least this share of its captions: スターダ (40
+# captions) is nearly always スターダスト (31).
+FRAGMENT_SHARE = 0.75
+
+# _lock guards the caches and _generation; _pool_changed guards the pool;
+# _suggest_loading lets one thread at a time read the suggestion terms.
+_lock = threading.Lock()
+_pool_changed = threading.Condition()
+_suggest_loading = threading.Lock()
+_preloader = None
+_held = threading.local()
+_idle = []
+_open = 0
+_generation = None
+_commits = 0
+_results = OrderedDict()
+_text_blocks = OrderedDict()
+_suggestions = None
+
+class _PooledConnection(sqlite3.Connection):
+    """A pooled read connection, with the file and data_version it last saw."""
+    file_id = None
+    data_version = None
+
+def connect(db_file=None, factory=sqlite3.Connection):
+    """Opens a read-only connection to the database with read-tuned pragmas."""
+    db_file = db_file or DB_FILE
+    uri = 'file:' + urllib.request.pathname2url(os.path.abspath(db_file)) + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=factory)
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+    conn.execute('PRAGMA query_only = ON')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _file_id(db_file):
+    """Identity of the database file; it changes when rebuild_db.py swaps in a new file."""
+    st = os.stat(db_file)
+    return st.st_dev, st.st_ino
+
+def _refresh(conn):
+    """
+    Drops the cached results when the database changed since conn last looked.
+
+    PRAGMA data_version tells whether another connection committed since
+    conn's last query; only then is the generation counter written by
+    rebuild_db.py read, and the caches are cleared when it moved. A
+    connection to a replaced file was already reopened by _checkout().
+    """
+    global _generation, _commits, _suggestions
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    if data_version == conn.data_version:
+        return
+    first_look = conn.data_version is None
+    conn.data_version = data_version
+
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    with _lock:
+        if row:
+            generation = row[0]
+        else:
+            # Without the counter, every commit a connection sees is a change.
+            if not first_look:
+                _commits += 1
+            generation = (conn.file_id, _commits)
+        changed = generation != _generation
+        if changed:
+            _results.clear()
+            _text_blocks.clear()
+            _suggestions = None
+            _generation = generation
+    if changed:
+        preload_suggestions()
+
+def _checkout():
+    """Takes an idle connection from the pool, or opens one if fewer than POOL_SIZE are open."""
+    global _open
+    with _pool_changed:
+        while not _idle and _open >= POOL_SIZE:
+            _pool_changed.wait()
+        conn = _idle.pop() if _idle else None
+        if conn is None:
+            _open += 1
+    # The slot is taken from here on: give it back if the file is missing
+    # (before the first build, or mid-swap) or cannot be opened.
+    try:
+        file_id = _file_id(DB_FILE)
+        if conn is not None and conn.file_id != file_id:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = connect(DB_FILE, _PooledConnection)
+            conn.file_id = file_id
+    except BaseException:
+        if conn is not None:
+            conn.close()
+        with _pool_changed:
+            _open -= 1
+            _pool_changed.notify()
+        raise
+    return conn
+
+def _checkin(conn):
+    global _open
+    with _pool_changed:
+        if os.path.exists(DB_FILE + SWAP_SUFFIX):
+            conn.close()
+            _open -= 1
+        else:
+            _idle.append(conn)
+        _pool_changed.notify()
+
+def pool_status():
+    """(connections open, connections idle) in the pool."""
+    with _pool_changed:
+        return _open, len(_idle)
+
+@contextmanager
+def _pooled():
+    """A connection from the pool for one query, refreshed first (see _refresh)."""
+    conn = getattr(_held, 'conn', None)
+    if conn is not None:
+        # Inside connection() on this thread: every query runs on its connection.
+        _refresh(conn)
+        yield conn
+        return
+    conn = _checkout()
+    try:
+        _refresh(conn)
+        yield conn
+    finally:
+        _checkin(conn)
+
+@contextmanager
+def connection():
+    """
+    A connection from the pool, held by this thread until the block ends,
+    for callers that need the connection itself (e.g. to set a progress
+    handler). Every query this thread makes in the block runs on it.
+    """
+    with _pooled() as conn:
+        outer = getattr(_held, 'conn', None)
+        _held.conn = conn
+        try:
+            yield conn
+        finally:
+            _held.conn = outer
+
+def normalize_query(query):
+    """Collapses whitespace (including full-width spaces), which MATCH treats alike anyway."""
+    return ' '.join(query.split())
+
+def _swapping():
+    """
+    True while rebuild_db.py is renaming a new database over DB_FILE.
+
+    The pooled connections are closed (busy ones when they are returned)
+    and queries use a short-lived connection each, so the file is not held
+    open (Windows cannot rename an open file).
+    """
+    global _open
+    if not os.path.exists(DB_FILE + SWAP_SUFFIX):
+        return False
+    with _pool_changed:
+        while _idle:
+            _idle.pop().close()
+            _open -= 1
+        _pool_changed.notify_all()
+    return True
+
+def _run_uncached(sql, params):
+    conn = connect(DB_FILE)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+def execute(sql, params=()):
+    """Runs a query on a pooled connection and returns all rows (uncached)."""
+    if _swapping():
+        return _run_uncached(sql, params)
+    with _pooled() as conn:
+        return conn.execute(sql, params).fetchall()
+
+def cached(key, sql, params=()):
+    """
+    Like execute(), but answers repeated keys from the LRU result cache.
+
+    The query itself runs outside _lock. Its rows are only cached if the
+    generation did not move meanwhile, so a slow query that started before
+    a reindex cannot put stale rows back into a cache that was just cleared.
+    """
+    if _swapping():
+        return _run_uncached(sql, params)
+    with _pooled() as conn:
+        with _lock:
+            if key in _results:
+                _results.move_to_end(key)
+                return _results[key]
+            generation = _generation
+        rows = conn.execute(sql, params).fetchall()
+    with _lock:
+        if _generation == generation:
+            _results[key] = rows
+            if len(_results) > RESULT_CACHE_SIZE:
+                _results.popitem(last=False)
+    return rows
+
+def _read_blocks(conn, blocks):
+    """{(video_id, block): [caption texts]} for the blocks, read and decompressed."""
+    zdict = textstore.load_dictionary(conn)
+    values = ', '.join('(?, ?)' for _ in blocks)
+    rows = conn.execute(f'''
+        WITH b (video_id, block) AS (VALUES {values})
+        SELECT t.video_id, t.block, t.data FROM b
+        JOIN caption_text t ON t.video_id = b.video_id AND t.block = b.block
+    ''', [value for block in blocks for value in block])
+    return {(video_id, block): textstore.decompress_block(data, zdict) for video_id, block, data in rows}
+
+def caption_texts(keys):
+    """
+    {(video_id, seq): caption text} for the given captions.
+
+    Only the compressed blocks holding them are read, and decompressed
+    blocks are kept in an LRU cache until the database changes, so a page
+    that is shown again costs no decompression.
+    """
+    needed = list(dict.fromkeys((video_id, seq // textstore.BLOCK_CAPTIONS) for video_id, seq in keys))
+    if not needed:
+        return {}
+    if _swapping():
+        conn = connect(DB_FILE)
+        try:
+            blocks = _read_blocks(conn, needed)
+        finally:
+            conn.close()
+    else:
+        with _pooled() as conn:
+            with _lock:
+                blocks = {}
+                for block in needed:
+                    if block in _text_blocks:
+                        _text_blocks.move_to_end(block)
+                        blocks[block] = _text_blocks[block]
+                generation = _generation
+            missing = [block for block in needed if block not in blocks]
+            read = _read_blocks(conn, missing) if missing else {}
+        blocks.update(read)
+        with _lock:
+            if read and _generation == generation:
+                _text_blocks.update(read)
+                while len(_text_blocks) > TEXT_CACHE_SIZE:
+                    _text_blocks.popitem(last=False)
+
+    texts = {}
+    for video_id, seq in keys:
+        block = blocks.get((video_id, seq // textstore.BLOCK_CAPTIONS))
+        if block and seq % textstore.BLOCK_CAPTIONS < len(block):
+            texts[video_id, seq] = block[seq % textstore.BLOCK_CAPTIONS]
+    return texts
+
+def _with_text(rows, spans=False):
+    """
+    The rows as dicts with their caption `text`. With spans=True, a row
+    found across a caption boundary gets the next caption's text appended.
+    """
+    keys = [(row['video_id'], row['seq']) for row in rows]
+    if spans:
+        keys += [(row['video_id'], row['seq'] + 1) for row in rows if row['spans']]
+    texts = caption_texts(keys)
+    filled = []
+    for row in rows:
+        row = dict(row)
+        row['text'] = texts.get((row['video_id'], row['seq']), '')
+        if spans and row['spans']:
+            row['text'] += texts.get((row['video_id'], row['seq'] + 1), '')
+        filled.append(row)
+    return filled
+
+def list_videos():
+    """All videos as [(id, date, title), ...], newest first."""
+    return cached(('videos',), 'SELECT id, date, title FROM videos ORDER BY date DESC')
+
+def list_tags():
+    """All title tags as [(tag, number of videos), ...], most used first."""
+    return cached(('tags',), 'SELECT tag, count(*) AS videos FROM video_tags GROUP BY tag ORDER BY videos DESC, tag')
+
+def generation():
+    """
+    The generation counter written by rebuild_db.py, which moves on with
+    every change to the index (None for a database without one).
+    """
+    rows = execute("SELECT value FROM meta WHERE key = 'generation'")
+    return rows[0][0] if rows else None
+
+def _whole_terms(rows):
+    """(terms, counts) of sorted (term, captions) rows, without the fragments of longer words."""
+    words = []
+    counts = []
+    for i, (term, hits) in enumerate(rows):
+        # The terms starting with this one follow it in sorted order.
+        longest = 0
+        j = i + 1
+        while j < len(rows) and rows[j][0].startswith(term):
+            longest = max(longest, rows[j][1])
+            j += 1
+        if longest < FRAGMENT_SHARE * hits:
+            words.append(term)
+            counts.append(hits)
+    return words, counts
+
+def _suggest_index():
+    """
+    The suggestion terms as (sorted terms, their caption counts), read from
+    suggest_terms once per generation and then answered from memory.
+    Fragments of longer words are left out (see FRAGMENT_SHARE).
+    """
+    global _suggestions
+    if _swapping():
+        return [], []
+    with _pooled() as conn:
+        with _lock:
+            if _suggestions is not None:
+                return _suggestions
+        # A load already under way (see preload_suggestions) is waited for.
+        with _suggest_loading:
+            with _lock:
+                if _suggestions is not None:
+                    return _suggestions
+                generation = _generation
+            try:
+                rows = conn.execute('''
+                    SELECT term, captions FROM suggest_terms
+                    WHERE captions > 0 AND (words >= ? OR titles > 0)
+                    ORDER BY term
+                ''', (SUGGEST_MIN_WORDS,)).fetchall()
+            except sqlite3.OperationalError:
+                # A database built before suggest_terms existed.
+                rows = []
+            index = _whole_terms(rows)
+            with _lock:
+                if _generation == generation:
+                    _suggestions = index
+    return index
+
+def preload_suggestions():
+    """
+    Loads the suggestion index on a background thread. Called whenever the
+    generation moves on, so even the first suggest() after a reindex is
+    answered from memory.
+    """
+    global _preloader
+
+    def load():
+        try:
+            _suggest_index()
+        except (OSError, sqlite3.Error):
+            # The database is missing or mid-swap; suggest() loads it later.
+            pass
+
+    _preloader = threading.Thread(target=load, name='suggest-preload', daemon=True)
+    _preloader.start()
+
+# Hiragana to katakana, so すたー also completes to スターレイル.
+_KATAKANA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+def suggest(query, limit=SUGGESTIONS):
+    """
+    Completions of the last term of query, as [(term, hits), ...], most hits first.
+
+    hits is the number of captions containing the term, which is what a
+    search for the term alone finds (not counting phrases across caption
+    boundaries). The terms are words seen in the captions and titles (see
+    rebuild_db.term_counts); the ones starting with the typed prefix are a
+    range of the sorted list, found by binary search, so no FTS index is
+    queried.
+    """
+    terms = normalize_query(query).split()
+    if not terms:
+        return []
+    words, counts = _suggest_index()
+    prefix = terms[-1].lower()
+    keys = dict.fromkeys((prefix, prefix.translate(_KATAKANA)))
+    candidates = set()
+    for key in keys:
+        lo = bisect.bisect_left(words, key)
+        hi = bisect.bisect_left(words, key + '\U0010ffff')
+        candidates.update(range(lo, hi))
+    # The typed term itself (or its katakana form) completes nothing.
+    candidates = {i for i in candidates if words[i] not in keys}
+    best = heapq.nlargest(limit, candidates, key=lambda i: (counts[i], -len(words[i])))
+    return [(words[i], counts[i]) for i in best]
+
+def ingest_status():
+    """(ingested_at unix time, ingest lag in seconds) of the last change indexed by rebuild_db.py --watch, or None."""
+    meta = dict(execute("SELECT key, value FROM meta WHERE key IN ('ingested_at', 'ingest_lag')"))
+    if 'ingested_at' not in meta:
+        return None
+    return meta['ingested_at'], meta['ingest_lag']
+
+def _filter_sql(filters):
+    """SQL conditions and parameters for the optional filters of a search."""
+    sql = ''
+    params = []
+    filters = filters or {}
+    if filters.get('date_from'):
+        sql += ' AND v.date >= ?'
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        sql += ' AND v.date <= ?'
+        params.append(filters['date_to'])
+    if filters.get('video_id'):
+        sql += ' AND v.id = ?'
+        params.append(filters['video_id'])
+    if filters.get('month'):
+        # YYYYMM, as a date range so the videos_date index applies.
+        sql += ' AND v.date BETWEEN ? AND ?'
+        params.extend((filters['month'] + '01', filters['month'] + '31'))
+    if filters.get('tag'):
+        sql += ' AND v.id IN (SELECT video_id FROM video_tags WHERE tag = ?)'
+        params.append(filters['tag'])
+    return sql, params
+
+def _phrase(term):
+    """Quotes a term as an FTS5 phrase, so operators and punctuation are matched literally."""
+    return '"' + term.replace('"', '""') + '"'
+
+def plan_query(query):
+    """
+    Splits a query into (trigram MATCH, short-term MATCH), either may be None.
+
+    Space-separated terms are ANDed, as before. Terms of SHORT_TERM_MAX
+    characters or fewer cannot be found with trigrams, so they go to the
+    captions_chars index as a phrase of single characters.
+    """
+    terms = normalize_query(query).split()
+    long_terms = [_phrase(t) for t in terms if len(t) > SHORT_TERM_MAX]
+    short_terms = [_phrase(' '.join(t)) for t in terms if len(t) <= SHORT_TERM_MAX]
+    return (' AND '.join(long_terms) or None, ' AND '.join(short_terms) or None)
+
+def _match_sql(query, spans=False):
+    """
+    CTEs ending in `m`, a row (id, score, spans) for every caption that matches query.
+
+    The trigram index drives the search whenever there is a long term, with
+    short terms applied as a rowid filter from captions_chars; a query of
+    only short terms is answered from captions_chars alone. Either way the
+    lookup goes through an FTS index, never a scan of the captions.
+
+    With spans=True, long terms are also looked up in captions_joins, the
+    windows across each caption boundary. A window hit counts (spans = 1,
+    under the first caption's id) only when neither of its two captions
+    matches on its own, so every phrase is found once, at the caption where
+    it begins. The next caption's id is always the window's rowid + 1 (see
+    SEQ_BITS). Short terms still have to be in that caption.
+
+    `m` is never materialized, so bm25() is only computed by queries that
+    use the score, not for every match of a count.
+    """
+    long_match, short_match = plan_query(query)
+    if not long_match:
+        sql = '''m AS NOT MATERIALIZED (
+            SELECT rowid AS id, bm25(captions_chars) AS score, 0 AS spans
+            FROM captions_chars WHERE captions_chars MATCH ?)'''
+        return sql, [short_match]
+
+    short_sql = ''
+    short_params = []
+    if short_match:
+        short_sql = ' AND {} IN (SELECT rowid FROM captions_chars WHERE captions_chars MATCH ?)'
+        short_params = [short_match]
+    direct_sql = f'''
+            SELECT rowid AS id, bm25(captions_fts) AS score, 0 AS spans
+            FROM captions_fts WHERE captions_fts MATCH ?{short_sql.format('rowid')}'''
+    if not spans:
+        return f'm AS NOT MATERIALIZED ({direct_sql})', [long_match] + short_params
+
+    sql = f'''direct AS MATERIALIZED ({direct_sql}),
+        m AS NOT MATERIALIZED (
+            SELECT * FROM direct
+            UNION ALL
+            SELECT j.rowid, bm25(captions_joins), 1
+            FROM captions_joins j
+            WHERE captions_joins MATCH ?{short_sql.format('j.rowid')}
+              AND j.rowid NOT IN (SELECT id FROM direct)
+              AND j.rowid + 1 NOT IN (SELECT id FROM direct))'''
+    return sql, [long_match] + short_params + [long_match] + short_params
+
+def _cache_key(*parts, filters=None):
+    return parts + (tuple(sorted((filters or {}).items())),)
+
+def _per_video_sql(query, filters, spans):
+    """
+    CTEs ending in `per_video`, a row (video_id, hits) for every video with
+    captions matching query and filters.
+
+    The video of a match is the high bits of its rowid (see SEQ_BITS), so
+    the matches are counted straight from the FTS rowids, and only the
+    grouped videos are joined to the videos table for the filters, which
+    are all about the video.
+    """
+    match_sql, match_params = _match_sql(query, spans)
+    filter_sql, filter_params = _filter_sql(filters)
+    sql = f'''{match_sql},
+        per_video AS MATERIALIZED (
+            SELECT v.id AS video_id, p.hits
+            FROM (SELECT id >> {SEQ_BITS} AS no, count(*) AS hits FROM m GROUP BY 1) p
+            JOIN videos v ON v.no = p.no
+            WHERE 1 {filter_sql}
+        )'''
+    return sql, match_params + filter_params
+
+def count(query, filters=None, spans=False):
+    """Exact (number of matching captions, number of videos they are in)."""
+    query = normalize_query(query)
+    if not query:
+        return 0, 0
+    per_video_sql, params = _per_video_sql(query, filters, spans)
+    sql = f'WITH {per_video_sql} SELECT COALESCE(sum(hits), 0), count(*) FROM per_video'
+    key = _cache_key('count', query, spans, filters=filters)
+    return tuple(cached(key, sql, params)[0])
+
+def video_hits(query, filters=None, order='date', spans=False):
+    """
+    The videos with captions matching query, as rows with video_id, date,
+    title and hits (exact, see _per_video_sql): newest first for
+    order='date', otherwise most hits first.
+    """
+    query = normalize_query(query)
+    if not query:
+        return []
+    per_video_sql, params = _per_video_sql(query, filters, spans)
+    order_sql = 'v.date DESC, v.id' if order == 'date' else 'p.hits DESC, v.date DESC, v.id'
+    sql = f'''
+        WITH {per_video_sql}
+        SELECT v.id AS video_id, v.date, v.title, p.hits
+        FROM per_video p JOIN videos v ON v.id = p.video_id
+        ORDER BY {order_sql}
+    '''
+    key = _cache_key('video_hits', query, order == 'date', spans, filters=filters)
+    return cached(key, sql, params)
+
+def facets(query, filters=None, spans=False):
+    """
+    Exact hit counts of a query per video, per month and per title tag.
+
+    Returns {'videos': {video_id: hits}, 'months': {YYYYMM: (hits, videos)},
+    'tags': {tag: (hits, videos)}}. The matches are counted per video in
+    SQL (see _per_video_sql); months and tags are rolled up from those few
+    hundred counts with the videos and video_tags tables, so no hit is ever
+    read into Python and the whole facet is one query.
+    """
+    query = normalize_query(query)
+    result = {'videos': {}, 'months': {}, 'tags': {}}
+    if not query:
+        return result
+    per_video_sql, params = _per_video_sql(query, filters, spans)
+    sql = f'''
+        WITH {per_video_sql}
+        SELECT 'videos' AS facet, video_id AS value, hits, 1 AS videos FROM per_video
+        UNION ALL
+        SELECT 'months', substr(v.date, 1, 6), sum(p.hits), count(*)
+        FROM per_video p JOIN videos v ON v.id = p.video_id
+        GROUP BY 2
+        UNION ALL
+        SELECT 'tags', t.tag, sum(p.hits), count(*)
+        FROM per_video p JOIN video_tags t ON t.video_id = p.video_id
+        GROUP BY 2
+    '''
+    key = _cache_key('facets', query, spans, filters=filters)
+    for row in cached(key, sql, params):
+        if row['facet'] == 'videos':
+            result['videos'][row['value']] = row['hits']
+        else:
+            result[row['facet']][row['value']] = (row['hits'], row['videos'])
+    return result
+
+def search(query, filters=None, order='date', cursor=None, limit=PAGE_SIZE, spans=False):
+    """
+    One page of full-text search results.
+
+    filters may hold date_from / date_to (YYYYMMDD), video_id, month
+    (YYYYMM) and tag (a title tag, see rebuild_db.title_tags). order is
+    one of ORDERS: 'date' (newest video first, then by time in the video),
+    'relevance' (bm25), 'recent' (bm25 decayed by the video's age) or
+    'hybrid' (see _search_hybrid).
+    Pass the returned cursor back in to get the next page; it is None on the
+    last page. Only the requested page is read from the database.
+    spans=True also finds phrases split across two captions (see
+    _match_sql); such a row's text is its caption followed by the next one.
+
+    Returns (rows, next_cursor). Rows have date, title, text, start_ms,
+    word_times, seq, spans, video_id, id and score.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"unknown order: {order}")
+    query = normalize_query(query)
+    if not query:
+        return [], None
+    if order == 'hybrid':
+        return _search_hybrid(query, filters, cursor, limit, spans)
+    rows, cursor = _search_rows(query, filters, order, cursor, limit, spans)
+    return _with_text(rows, spans), cursor
+
+def _search_rows(query, filters, order, cursor, limit, spans):
+    """search() for a keyword order, without the caption text."""
+    match_sql, match_params = _match_sql(query, spans)
+    filter_sql, filter_params = _filter_sql(filters)
+
+    score_params = []
+    if order == 'date':
+        score_sql = '0.0'
+        order_sql = 'date DESC, video_id, start_ms, id'
+        page_sql = '(date < ? OR (date = ? AND (video_id, start_ms, id) > (?, ?, ?)))'
+        page_params = [cursor[0], *cursor] if cursor else []
+    else:
+        # bm25() is negative, more negative is better. 'recent' shrinks it
+        # towards 0 by the video's age in years relative to the newest video.
+        score_sql = 'm.score'
+        if order == 'recent':
+            score_sql = f'''m.score / (1.0 + {RECENCY_DECAY} * (? - julianday(
+                substr(v.date, 1, 4) || '-' || substr(v.date, 5, 2) || '-' || substr(v.date, 7, 2))) / 365.25)'''
+            score_params = [_newest_julianday()]
+        order_sql = 'score, id'
+        page_sql = '(score, id) > (?, ?)'
+        page_params = list(cursor or ())
+
+    sql = f'''
+        WITH {match_sql}
+        SELECT * FROM (
+            SELECT v.date, v.title, c.start_ms, c.word_times, c.seq, m.spans,
+                   v.id AS video_id, c.id AS id, {score_sql} AS score
+            FROM m
+            JOIN captions c ON c.id = m.id
+            JOIN videos v ON v.id = c.video_id
+            WHERE 1 {filter_sql}
+        )
+        {'WHERE ' + page_sql if cursor else ''}
+        ORDER BY {order_sql}
+        LIMIT ?
+    '''
+    params = match_params + score_params + filter_params + page_params + [limit + 1]
+
+    key = _cache_key('search', query, order, tuple(cursor or ()), limit, spans, filters=filters)
+    rows = cached(key, sql, params)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if order == 'date':
+        return rows, (last['date'], last['video_id'], last['start_ms'], last['id'])
+    return rows, (last['score'], last['id'])
+
+def _search_hybrid(query, filters, cursor, limit, spans):
+    """
+    search() with order='hybrid': keyword and semantic hits in one ranking.
+
+    Both rankings are cut to HYBRID_CANDIDATES and fused per embedding
+    window (embed_db.WINDOW_CAPTIONS captions). A window with a keyword hit
+    is shown as its best keyword row; a window found only by meaning is
+    shown whole, as a row spanning its captions. The cursor is the offset
+    of the next page.
+    """
+    import embed_db
+    import vector_index
+
+    window = embed_db.WINDOW_CAPTIONS
+    keyword_rows, _ = _search_rows(query, filters, 'relevance', None, HYBRID_CANDIDATES, spans)
+    video_ids = None
+    if any((filters or {}).values()):
+        filter_sql, filter_params = _filter_sql(filters)
+        video_ids = [row[0] for row in cached(_cache_key('video_ids', filters=filters),
+                                              f'SELECT v.id FROM videos v WHERE 1 {filter_sql}',
+                                              filter_params)]
+    windows = vector_index.search(query, video_ids, HYBRID_CANDIDATES)
+
+    fused = {}
+    for rank, row in enumerate(keyword_rows, 1):
+        entry = fused.setdefault((row['video_id'], row['seq'] // window), {'score': 0.0})
+        if 'row' not in entry:
+            entry['score'] += 1 / (HYBRID_RRF_K + rank)
+            entry['row'] = row
+    for rank, (video_id, seq_lo, seq_hi, _) in enumerate(windows, 1):
+        entry = fused.setdefault((video_id, seq_lo // window), {'score': 0.0})
+        entry['score'] += 1 / (HYBRID_RRF_K + rank)
+        entry['window'] = (video_id, seq_lo, seq_hi)
+    ranked = sorted(fused.items(), key=lambda item: (-item[1]['score'], item[0]))
+
+    offset = cursor or 0
+    page = [entry for _, entry in ranked[offset:offset + limit]]
+    captions = defaultdict(list)
+    ranges = [entry['window'] for entry in page if 'row' not in entry]
+    if ranges:
+        values = ', '.join('(?, ?, ?)' for _ in ranges)
+        for caption in execute(f'''
+            WITH w (video_id, lo, hi) AS (VALUES {values})
+            SELECT v.date, v.title, c.start_ms, c.seq, c.video_id, c.id, w.lo
+            FROM w
+            JOIN captions c ON c.video_id = w.video_id AND c.seq BETWEEN w.lo AND w.hi
+            JOIN videos v ON v.id = c.video_id
+            ORDER BY c.video_id, c.seq
+        ''', [value for r in ranges for value in r]):
+            captions[caption['video_id'], caption['lo']].append(caption)
+    texts = caption_texts([(video_id, caption['seq']) for (video_id, _), lines in captions.items()
+                           for caption in lines])
+    # Only the keyword rows on this page get their text.
+    keyword_page = {row['id']: row for row in _with_text(
+        [entry['row'] for entry in page if 'row' in entry], spans)}
+
+    rows = []
+    for entry in page:
+        if 'row' in entry:
+            row = keyword_page[entry['row']['id']]
+        else:
+            # Captions of a window that was reindexed since it was embedded
+            # may be gone; such a window is left out.
+            lines = captions.get(entry['window'][:2])
+            if not lines:
+                continue
+            row = {key: lines[0][key] for key in ('date', 'title', 'start_ms', 'seq', 'video_id', 'id')}
+            row.update(text=' '.join(texts.get((line['video_id'], line['seq']), '') for line in lines),
+                       word_times=None,
+                       spans=lines[-1]['seq'] - lines[0]['seq'])
+        row['score'] = entry['score']
+        rows.append(row)
+    return rows, (offset + limit if len(ranked) > offset + limit else None)
+
+def context(rows, size):
+    """
+    The captions around each search row: {caption id: (before, after)}.
+
+    before and after hold up to `size` captions each (rows with seq,
+    start_ms and text), in time order. The seq ranges of a page are merged
+    per video and read in one query through the (video_id, seq) index, so
+    a page costs one query however many hits it has.
+    """
+    if size <= 0 or not rows:
+        return {}
+    ranges = []
+    for video_id in dict.fromkeys(row['video_id'] for row in rows):
+        # (first, last) caption of each hit; a hit across a boundary or a
+        # semantic hit covers several.
+        hits = sorted((row['seq'], row['seq'] + row['spans'])
+                      for row in rows if row['video_id'] == video_id)
+        lo, hi = hits[0][0] - size, hits[0][1] + size
+        for first, last in hits[1:]:
+            if first - size > hi + 1:
+                ranges.append((video_id, lo, hi))
+                lo = first - size
+            hi = max(hi, last + size)
+        ranges.append((video_id, lo, hi))
+
+    values = ', '.join('(?, ?, ?)' for _ in ranges)
+    sql = f'''
+        WITH ranges (video_id, lo, hi) AS (VALUES {values})
+        SELECT c.video_id, c.seq, c.start_ms
+        FROM ranges r
+        JOIN captions c ON c.video_id = r.video_id AND c.seq BETWEEN r.lo AND r.hi
+    '''
+    params = [value for r in ranges for value in r]
+    captions = {}
+    for caption in _with_text(cached(('context',) + tuple(ranges), sql, params)):
+        captions[caption['video_id'], caption['seq']] = caption
+
+    around = {}
+    for row in rows:
+        video_id, seq = row['video_id'], row['seq']
+        before = [captions[video_id, s] for s in range(seq - size, seq) if (video_id, s) in captions]
+        # A row spanning several captions already shows them.
+        first_after = seq + 1 + row['spans']
+        after = [captions[video_id, s] for s in range(first_after, first_after + size)
+                 if (video_id, s) in captions]
+        around[row['id']] = (before, after)
+    return around
+
+def _newest_julianday():
+    """julianday() of the newest video's date, the reference point for order='recent'."""
+    newest = list_videos()
+    if not newest:
+        return 0.0
+    date = newest[0]['date']
+    return execute('SELECT julianday(?)', (f"{date[:4]}-{date[4:6]}-{date[6:8]}",))[0][0] or 0.0
+
+def match_ms(query, text, start_ms, word_times):
+    """
+    Time of the first query term within a caption, in ms.
+
+    The term is looked up in the text and timed by the last word starting
+    at or before it, from the word timings stored with the caption. Without
+    word timings, or if no term is found as-is, it is the caption start.
+    """
+    if not word_times:
+        return start_ms
+    lowered = text.lower()
+    positions = [lowered.find(term.lower()) for term in normalize_query(query).split()]
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return start_ms
+    position = min(positions)
+    delta = 0
+    for offset, word_delta in unpack_word_times(word_times):
+        if offset > position:
+            break
+        delta = word_delta
+    return start_ms + delta
+
+def group_results(rows, query=None):
+    """
+    Groups search rows by video, keeping the order of the rows.
+
+    Returns {video_id: {'date', 'title', 'matches': [{'id', 'text', 'video_id',
+    'start_ms', 'match_ms'}]}}; match_ms is where query was said (see
+    match_ms()), start_ms when no query is given.
+    """
+    grouped = defaultdict(lambda: {'date': '', 'title': '', 'matches': []})
+    for row in rows:
+        video_id = row['video_id']
+        grouped[video_id]['date'] = row['date']
+        grouped[video_id]['title'] = row['title']
+        grouped[video_id]['matches'].append({
+            'id': row['id'],
+            'text': row['text'],
+            'video_id': video_id,
+            'start_ms': row['start_ms'],
+            'match_ms': match_ms(query, row['text'], row['start_ms'], row['word_times'])
+                        if query else row['start_ms']
+        })
+    return grouped
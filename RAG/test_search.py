@@ -1,4 +1,5 @@
 import sqlite3
+import textstore
 
 DB_FILE = 'kunue_rii.db'
 
@@ -8,9 +9,11 @@ def test_search(query):
     c = conn.cursor()
     try:
         c.execute('''
-            SELECT date, title, text, timestamp, url 
-            FROM subtitles 
-            WHERE subtitles MATCH ? 
+            SELECT v.date, v.title, c.seq, c.start_ms, v.id
+            FROM captions_fts
+            JOIN captions c ON c.id = captions_fts.rowid
+            JOIN videos v ON v.id = c.video_id
+            WHERE captions_fts MATCH ?
             LIMIT 5
         ''', (query,))
         results = c.fetchall()
@@ -18,9 +21,10 @@ def test_search(query):
         for row in results:
             print(f"Date: {row[0]}")
             print(f"Title: {row[1]}")
-            print(f"Text: {row[2]}")
-            print(f"Timestamp: {row[3]}")
-            print(f"URL: {row[4]}")
+            print(f"Text: {textstore.video_texts(conn, row[4])[row[2]]}")
+            seconds = row[3] // 1000
+            print(f"Timestamp: {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}")
+            print(f"URL: https://www.youtube.com/watch?v={row[4]}&t={seconds}s")
             print("-" * 20)
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+RAG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_DIR)
+# The Discord tools' YouTube client and thumbnail store are tested here too.
+sys.path.append(os.path.join(os.path.dirname(RAG_DIR), 'Discord-Text-Generation'))
+
+import rebuild_db
+import search_index
+
+VIDEO_FILE = '20250101_【原神】スターレイルとスターダスト_AbCdEfGhIjK.ja.vtt'
+
+CAPTIONS = [
+    'こんにちは、スターレイルをやります',
+    'スターレイルのガチャを引きます',
+    'スターダストが綺麗ですね',
+    'スターレイル楽しい',
+]
+
+def write_vtt(path, captions):
+    lines = ['WEBVTT', 'Kind: captions', 'Language: ja', '']
+    for i, text in enumerate(captions):
+        lines += [f'00:00:{i * 5:02d}.000 --> 00:00:{i * 5 + 4:02d}.000', text, '']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+def build_database(tmp_path):
+    """Builds a database of one video in tmp_path and returns its path."""
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir(exist_ok=True)
+    write_vtt(data_dir / VIDEO_FILE, CAPTIONS)
+    db_file = str(tmp_path / 'kunue_rii.db')
+    rebuild_db.rebuild_database(full=True, data_dir=str(data_dir), db_file=db_file)
+    return db_file
+
+@pytest.fixture(autouse=True)
+def fresh_pool(monkeypatch):
+    """Every test starts with an empty connection pool and empty caches."""
+    def reset():
+        if search_index._preloader is not None:
+            search_index._preloader.join()
+        with search_index._pool_changed:
+            for conn in search_index._idle:
+                conn.close()
+            search_index._idle.clear()
+            search_index._open = 0
+        with search_index._lock:
+            search_index._generation = None
+            search_index._results.clear()
+            search_index._text_blocks.clear()
+            search_index._suggestions = None
+
+    reset()
+    monkeypatch.setattr(search_index, 'DB_FILE', search_index.DB_FILE)
+    yield
+    reset()
+
+class StubServer:
+    """
+    A local HTTP server standing in for YouTube. routes maps a path to a
+    function (query, headers) -> (status, headers, body); every request is
+    recorded in requests as (path, query, headers).
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                stub.requests.append((url.path, query, dict(self.headers)))
+                route = stub.routes.get(url.path)
+                status, headers, body = route(query, self.headers) if route else (404, {}, b'')
+                self.send_response(status)
+                # A route may claim a longer body than it sends, to cut a download short.
+                headers.setdefault('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def paths(self):
+        return [path for path, _, _ in self.requests]
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
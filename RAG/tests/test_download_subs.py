@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import download_subs
+
+CHANNEL = 'https://www.youtube.com/@kunue_rii'
+
+class FakeYtDlp:
+    """Stands in for download_subs.run_yt_dlp: a channel of videos, each behaving as listed."""
+
+    def __init__(self, videos):
+        self.videos = videos
+        self.calls = []
+
+    def __call__(self, args):
+        url = args[-1]
+        if '--flat-playlist' in args:
+            return 0, '\n'.join(f'{video_id}\t{download_subs.video_url(video_id)}'
+                                for video_id in self.videos), ''
+        video_id = url.rsplit('=', 1)[1]
+        self.calls.append(video_id)
+        behaviour = self.videos[video_id]
+        if isinstance(behaviour, list):
+            # Fails with the queued errors first, then downloads.
+            behaviour = behaviour.pop(0) if behaviour else 'ok'
+        if behaviour == 'ok':
+            template = args[args.index('--output') + 1]
+            with open(template.replace('%(id)s', video_id) + '.ja.vtt', 'w', encoding='utf-8') as f:
+                f.write('WEBVTT\n')
+            return 0, f'20250101\tテスト配信 {video_id}\t{video_id}', ''
+        if behaviour == 'garbled':
+            return 0, 'not the printed metadata', ''
+        return 1, '', behaviour
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_subs, 'BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(download_subs.rebuild_db, 'DB_FILE', str(tmp_path / 'kunue_rii.db'))
+    path = tmp_path / 'data'
+    path.mkdir()
+    return str(path)
+
+def test_batch_survives_failing_videos(data_dir, monkeypatch):
+    fake = FakeYtDlp({
+        'aaaaaaaaaaa': 'ok',
+        'bbbbbbbbbbb': 'ERROR: Private video',
+        'ccccccccccc': 'garbled',
+        'ddddddddddd': ['ERROR: HTTP Error 429: Too Many Requests'] * 2,
+    })
+    monkeypatch.setattr(download_subs, 'run_yt_dlp', fake)
+
+    saved = download_subs.download_batch([CHANNEL], workers=2, retries=3, data_dir=data_dir)
+    assert sorted(os.path.basename(path) for path in saved) == [
+        '20250101_テスト配信 aaaaaaaaaaa_aaaaaaaaaaa.ja.vtt',
+        '20250101_テスト配信 ddddddddddd_ddddddddddd.ja.vtt',
+    ]
+    # The private video is not retried; the rate-limited one is, until it works.
+    assert fake.calls.count('bbbbbbbbbbb') == 1
+    assert fake.calls.count('ddddddddddd') == 3
+
+    # A second run skips what is already on disk.
+    fake.calls.clear()
+    assert download_subs.download_batch([CHANNEL], data_dir=data_dir) == []
+    assert fake.calls.count('aaaaaaaaaaa') == 0
+
+def test_unexpected_error_skips_only_that_video(data_dir, monkeypatch):
+    monkeypatch.setattr(download_subs, 'run_yt_dlp', FakeYtDlp({'aaaaaaaaaaa': 'ok'}))
+    # Moving the subtitle into a missing folder raises OSError.
+    missing = os.path.join(data_dir, 'missing')
+    assert download_subs.download_with_retry('aaaaaaaaaaa', data_dir=missing) is None
+
+def test_gives_up_after_retries(data_dir, monkeypatch):
+    fake = FakeYtDlp({'aaaaaaaaaaa': ['ERROR: timed out'] * 5})
+    monkeypatch.setattr(download_subs, 'run_yt_dlp', fake)
+    assert download_subs.download_with_retry('aaaaaaaaaaa', retries=2, data_dir=data_dir) is None
+    assert fake.calls == ['aaaaaaaaaaa'] * 3
@@ -0,0 +1,47 @@
+import pytest
+
+import rebuild_db
+
+class FakeClock:
+    """time.time() and time.sleep() for watch(): sleeping moves the clock on, until `seconds` have passed."""
+
+    def __init__(self, seconds):
+        self.now = 1000.0
+        self.end = self.now + seconds
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if self.now >= self.end:
+            raise KeyboardInterrupt
+        self.now += seconds
+
+@pytest.fixture
+def failing_watch(tmp_path, monkeypatch):
+    """Runs watch() for `seconds` on a folder that changes once, with every update after the first failing."""
+    def run(seconds):
+        clock = FakeClock(seconds)
+        updates = []
+
+        def rebuild_database(**kwargs):
+            updates.append(clock.now)
+            if len(updates) > 1:
+                raise OSError('database is locked')
+
+        changed = {'a.ja.vtt': (clock.now, 1)}
+        snapshots = iter([{}])
+        monkeypatch.setattr(rebuild_db, 'time', clock)
+        monkeypatch.setattr(rebuild_db, 'rebuild_database', rebuild_database)
+        monkeypatch.setattr(rebuild_db, 'snapshot', lambda data_dir: next(snapshots, changed))
+        rebuild_db.watch(data_dir=str(tmp_path), db_file=str(tmp_path / 'kunue_rii.db'))
+        return updates[1:]
+    return run
+
+def test_watch_backs_off_while_updates_fail(failing_watch):
+    retries = failing_watch(600)
+    gaps = [later - earlier for earlier, later in zip(retries, retries[1:])]
+    # 5s, 10s, 20s, 40s, then at most once a minute rather than every poll.
+    assert gaps[:4] == [6, 10, 20, 40]
+    assert all(gap >= rebuild_db.MAX_DEBOUNCE_SECONDS for gap in gaps[4:])
+    assert len(retries) < 15
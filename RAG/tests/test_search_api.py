@@ -0,0 +1,76 @@
+import pytest
+
+import search_api
+import search_index
+from conftest import build_database
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, 'DB_FILE', build_database(tmp_path))
+    return search_api.app.test_client()
+
+def test_suggest(client):
+    response = client.get('/api/suggest', query_string={'q': '原神 すたー'})
+    assert response.status_code == 200
+    assert response.get_json() == {'query': '原神 すたー', 'suggestions': [
+        {'term': 'スターレイル', 'hits': 3, 'query': '原神 スターレイル'},
+        {'term': 'スターダスト', 'hits': 1, 'query': '原神 スターダスト'},
+    ]}
+
+def test_suggest_limit(client):
+    response = client.get('/api/suggest', query_string={'q': 'スター', 'limit': 1})
+    assert [s['term'] for s in response.get_json()['suggestions']] == ['スターレイル']
+
+@pytest.mark.parametrize('query_string', [{}, {'q': ' '}, {'q': 'スター', 'limit': 0},
+                                          {'q': 'スター', 'limit': 51}, {'q': 'スター', 'limit': 'x'}])
+def test_suggest_bad_request(client, query_string):
+    response = client.get('/api/suggest', query_string=query_string)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_suggest_not_modified(client):
+    response = client.get('/api/suggest', query_string={'q': 'スター'})
+    etag = response.headers['ETag']
+    assert etag == f'"{search_index.generation()}"'
+    again = client.get('/api/suggest', query_string={'q': 'スター'}, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+def cursor(value):
+    return search_api.encode_cursor(value)
+
+def test_search_pages_with_cursor(client):
+    first = client.get('/api/search', query_string={'q': 'スターレイル', 'limit': 1}).get_json()
+    assert first['total'] == {'matches': 3, 'videos': 1}
+    second = client.get('/api/search', query_string={
+        'q': 'スターレイル', 'limit': 1, 'cursor': first['next_cursor']}).get_json()
+    assert second['results'][0]['start_ms'] > first['results'][0]['start_ms']
+
+@pytest.mark.parametrize('order, value', [
+    ('relevance', ['20250101', 'AbCdEfGhIjK', 0, 1]),
+    ('date', 5), ('date', [1]), ('date', 'x'), ('date', {'a': 1}),
+    ('date', [[1], 'AbCdEfGhIjK', 0, 1]), ('recent', [None, 1]),
+])
+def test_search_bad_cursor(client, order, value):
+    response = client.get('/api/search', query_string={'q': 'スター', 'order': order, 'cursor': cursor(value)})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'invalid cursor'}
+
+def test_hybrid_cursor():
+    # order=hybrid needs the vector index, so its cursors are checked directly.
+    assert search_api.decode_cursor(cursor(50), 'hybrid') == 50
+    for value in (-1, [0, 1], True, 1.5):
+        with pytest.raises(search_api.InvalidParameter):
+            search_api.decode_cursor(cursor(value), 'hybrid')
+
+def test_metrics_without_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, 'DB_FILE', str(tmp_path / 'kunue_rii.db'))
+    response = search_api.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'search_index_connections{state="open"} 0' in text
+    assert 'search_index_generation' not in text
+
+def test_suggest_complete_term(client):
+    response = client.get('/api/suggest', query_string={'q': 'すたーれいる'})
+    assert response.get_json()['suggestions'] == []
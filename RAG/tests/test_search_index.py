@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+
+import search_index
+from conftest import build_database
+
+def run_with_timeout(fn, seconds=10):
+    """fn()'s result, failing the test instead of hanging if it never returns."""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), 'query did not return (pool exhausted?)'
+    return result[0]
+
+def test_missing_database_does_not_leak_pool_slots(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'kunue_rii.db')
+    monkeypatch.setattr(search_index, 'DB_FILE', db_file)
+
+    def query_missing():
+        try:
+            search_index.execute('SELECT 1')
+        except (OSError, sqlite3.Error):
+            return False
+        return True
+
+    # Before the first build (or mid-swap) every query fails...
+    for _ in range(search_index.POOL_SIZE + 2):
+        assert not run_with_timeout(query_missing)
+    assert search_index.pool_status() == (0, 0)
+
+    # ...but once the database exists, queries get a connection again.
+    build_database(tmp_path)
+    assert run_with_timeout(search_index.generation) is not None
+    search_index._preloader.join()
+    connections_open, connections_idle = search_index.pool_status()
+    assert 1 <= connections_open == connections_idle
+
+def test_suggestions_preloaded_with_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, 'DB_FILE', build_database(tmp_path))
+    search_index.generation()
+    search_index._preloader.join()
+    assert search_index._suggestions is not None
+    assert search_index.suggest('すたー')[0] == ('スターレイル', 3)
+
+    # A reindex moves the generation on; the new terms are loaded again.
+    with sqlite3.connect(search_index.DB_FILE) as conn:
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+    conn.close()
+    search_index.generation()
+    search_index._preloader.join()
+    assert search_index._suggestions is not None
+
+def test_connection_runs_every_query_of_the_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, 'DB_FILE', build_database(tmp_path))
+    steps = []
+    with search_index.connection() as conn:
+        conn.set_progress_handler(lambda: steps.append(1), 1)
+        search_index._preloader.join()
+        # Another thread leaves a connection idle on top of the pool, as the
+        # suggestion preload does; this thread's queries still use conn.
+        run_with_timeout(search_index.generation)
+        assert search_index.pool_status() == (2, 1)
+        rows, _ = search_index.search('スターレイル', spans=True)
+        conn.set_progress_handler(None, 0)
+    assert len(rows) == 3
+    assert steps
+
+def test_suggest_leaves_out_the_typed_term(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, 'DB_FILE', build_database(tmp_path))
+    assert search_index.suggest('スター') == [('スターレイル', 3), ('スターダスト', 1)]
+    assert search_index.suggest('スターレイル') == []
+    # Also when it was typed in hiragana.
+    assert search_index.suggest('原神 すたーれいる') == []
@@ -0,0 +1,79 @@
+import os
+import hashlib
+import sqlite3
+
+import pytest
+import requests
+
+import thumbnail_store
+
+IMAGE = b'\xff\xd8\xff' + b'thumbnail' * 1000
+
+@pytest.fixture
+def store(stub_server, tmp_path, monkeypatch):
+    """A thumbnail store in tmp_path; the stub server serves IMAGE with an ETag."""
+    monkeypatch.setattr(thumbnail_store, 'DOWNLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(thumbnail_store, 'STORE_FOLDER', str(tmp_path / '.store'))
+    monkeypatch.setattr(thumbnail_store, 'INDEX_FILE', str(tmp_path / '.store' / 'index.db'))
+
+    def image(query, headers):
+        if headers.get('If-None-Match') == '"v1"':
+            return 304, {}, b''
+        return 200, {'Content-Type': 'image/jpeg', 'ETag': '"v1"'}, IMAGE
+
+    for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb'):
+        stub_server.routes[f'/vi/{video_id}/maxresdefault.jpg'] = image
+    stub_server.routes['/vi/broken/maxresdefault.jpg'] = lambda query, headers: (
+        200, {'Content-Length': str(len(IMAGE))}, IMAGE[:100])
+    stub_server.dir = tmp_path
+    return stub_server
+
+def thumbnail_url(store, video_id):
+    return f'{store.url}/vi/{video_id}/maxresdefault.jpg'
+
+def blobs(store):
+    return [name for _, _, names in os.walk(store.dir / '.store') for name in names if name.endswith('.jpg')]
+
+def test_repeat_save_sends_no_request(store):
+    path = str(store.dir / '20250101_配信.jpg')
+    assert thumbnail_store.save(thumbnail_url(store, 'aaaaaaaaaaa'), path, 'aaaaaaaaaaa')
+    with open(path, 'rb') as f:
+        assert f.read() == IMAGE
+    assert os.path.samefile(path, thumbnail_store.blob_path(hashlib.sha256(IMAGE).hexdigest()))
+
+    assert not thumbnail_store.save(thumbnail_url(store, 'aaaaaaaaaaa'), path, 'aaaaaaaaaaa')
+    assert len(store.requests) == 1
+
+def test_revalidation_uses_the_etag(store, monkeypatch):
+    path = str(store.dir / '20250101_配信.jpg')
+    thumbnail_store.save(thumbnail_url(store, 'aaaaaaaaaaa'), path, 'aaaaaaaaaaa')
+    monkeypatch.setattr(thumbnail_store, 'REVALIDATE_SECONDS', 0)
+    os.remove(path)
+
+    assert not thumbnail_store.save(thumbnail_url(store, 'aaaaaaaaaaa'), path, 'aaaaaaaaaaa')
+    assert store.requests[-1][2]['If-None-Match'] == '"v1"'
+    with open(path, 'rb') as f:
+        assert f.read() == IMAGE
+
+def test_identical_images_are_stored_once(store):
+    for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb'):
+        thumbnail_store.save(thumbnail_url(store, video_id), str(store.dir / f'{video_id}.jpg'), video_id)
+    assert len(blobs(store)) == 1
+
+def test_broken_download_leaves_no_file(store):
+    path = str(store.dir / 'broken.jpg')
+    with pytest.raises(requests.RequestException):
+        thumbnail_store.save(thumbnail_url(store, 'broken'), path, 'broken')
+    assert not os.path.exists(path)
+    assert blobs(store) == []
+    assert not [name for _, _, names in os.walk(store.dir) for name in names if name.endswith('.part')]
+
+def test_index_looks_up_videos_without_a_scan(store):
+    thumbnail_store.save(thumbnail_url(store, 'aaaaaaaaaaa'), str(store.dir / 'a.jpg'), 'aaaaaaaaaaa')
+    conn = sqlite3.connect(thumbnail_store.INDEX_FILE)
+    try:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT sha256 FROM thumbnails WHERE video_id = ?', ('aaaaaaaaaaa',)))
+    finally:
+        conn.close()
+    assert 'USING INDEX thumbnails_video' in plan
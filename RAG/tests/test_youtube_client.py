@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import youtube_client
+
+class Clock:
+    """Stands in for the time module in youtube_client."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def api(stub_server, tmp_path, monkeypatch):
+    """The stub server as the YouTube API: videos.list knows the videos in api.videos."""
+    clock = Clock()
+    monkeypatch.setattr(youtube_client, 'time', clock)
+    monkeypatch.setattr(youtube_client, 'API_BASE_URL', stub_server.url)
+    monkeypatch.setattr(youtube_client, 'CACHE_FILE', str(tmp_path / 'metadata_cache.db'))
+    videos = {}
+
+    def videos_list(query, headers):
+        if query.get('key') != 'test-key':
+            return 403, {}, b''
+        items = [{'id': video_id, 'snippet': {'title': video_id, 'liveBroadcastContent': state}}
+                 for video_id, state in videos.items() if video_id in query['id'].split(',')]
+        return 200, {'Content-Type': 'application/json'}, json.dumps({'items': items}).encode()
+
+    stub_server.routes['/videos'] = videos_list
+    stub_server.clock = clock
+    stub_server.videos = videos
+    return stub_server
+
+def calls(api):
+    return [query['id'].split(',') for path, query, _ in api.requests if path == '/videos']
+
+def test_batch_lookup_is_one_call_and_cached(api):
+    api.videos.update({'aaaaaaaaaaa': 'none', 'bbbbbbbbbbb': 'none'})
+    found = youtube_client.get_videos(['aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc', 'aaaaaaaaaaa'], 'test-key')
+    assert sorted(found) == ['aaaaaaaaaaa', 'bbbbbbbbbbb']
+    assert calls(api) == [['aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc']]
+    assert 'maxResults' not in api.requests[0][1]
+
+    # Cached videos cost no call; only the unknown one is asked for again.
+    api.clock.now += 60
+    assert youtube_client.get_video('aaaaaaaaaaa', 'test-key')['id'] == 'aaaaaaaaaaa'
+    assert youtube_client.get_video('ccccccccccc', 'test-key') is None
+    assert calls(api)[1:] == [['ccccccccccc']]
+
+def test_calls_are_split_at_the_id_limit(api):
+    video_ids = [f'video{i:06d}' for i in range(120)]
+    api.videos.update(dict.fromkeys(video_ids, 'none'))
+    assert len(youtube_client.get_videos(video_ids, 'test-key')) == 120
+    assert [len(ids) for ids in calls(api)] == [50, 50, 20]
+
+def test_entries_expire_by_broadcast_state(api):
+    api.videos.update({'upcomingvid': 'upcoming', 'finishedvid': 'none'})
+    youtube_client.get_videos(['upcomingvid', 'finishedvid'], 'test-key')
+
+    api.clock.now += youtube_client.TTL_SECONDS['upcoming'] - 1
+    youtube_client.get_videos(['upcomingvid', 'finishedvid'], 'test-key')
+    assert len(calls(api)) == 1
+
+    # An upcoming stream is looked up again after 10 minutes, a finished video is not.
+    api.clock.now += 2
+    youtube_client.get_videos(['upcomingvid', 'finishedvid'], 'test-key')
+    assert calls(api)[1:] == [['upcomingvid']]
+
+    api.clock.now += youtube_client.TTL_SECONDS['none']
+    youtube_client.get_video('finishedvid', 'test-key')
+    assert calls(api)[2:] == [['finishedvid']]
+
+def test_least_recently_used_entries_are_evicted(api, monkeypatch):
+    monkeypatch.setattr(youtube_client, 'CACHE_MAX_ENTRIES', 2)
+    api.videos.update(dict.fromkeys(['aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc'], 'none'))
+    for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb', 'aaaaaaaaaaa', 'ccccccccccc'):
+        api.clock.now += 1
+        youtube_client.get_video(video_id, 'test-key')
+    assert calls(api) == [['aaaaaaaaaaa'], ['bbbbbbbbbbb'], ['ccccccccccc']]
+
+    # b was used least recently, so c's entry pushed it out; a is still cached.
+    api.clock.now += 1
+    youtube_client.get_video('aaaaaaaaaaa', 'test-key')
+    youtube_client.get_video('bbbbbbbbbbb', 'test-key')
+    assert calls(api)[3:] == [['bbbbbbbbbbb']]
+
+def test_api_error(api):
+    with pytest.raises(youtube_client.YouTubeAPIError) as error:
+        youtube_client.get_video('aaaaaaaaaaa', 'wrong-key')
+    assert error.value.status_code == 403
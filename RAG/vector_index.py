@@ -0,0 +1,115 @@
+"""
+Semantic search over the caption windows embedded by embed_db.py.
+
+The int8 matrix is memory-mapped and scanned with NumPy in blocks, which
+at about 100k windows is faster than building and probing an ANN index.
+numpy and sentence-transformers are optional: without them, or without a
+vector index, available() is False and the app offers keyword search only.
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import embed_db
+
+# Configuration
+VECTOR_DB_FILE = embed_db.VECTOR_DB_FILE
+
+# Rows converted to float32 at a time while scoring; keeps the temporary
+# copy at a few MB instead of the whole matrix.
+SCAN_BLOCK = 8192
+
+# Query embeddings kept in memory, so paging and reruns skip the model.
+QUERY_CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_model = None
+_index = None
+_index_state = None
+_queries = OrderedDict()
+
+class _Index:
+    """The current matrix (memory-mapped) and its window table as arrays."""
+
+    def __init__(self, conn):
+        import numpy as np
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        self.model_name = meta['model']
+        self.matrix = np.load(embed_db.matrix_path(VECTOR_DB_FILE, meta['matrix']), mmap_mode='r')
+        rows = conn.execute('SELECT video_id, seq_lo, seq_hi, scale FROM windows ORDER BY row').fetchall()
+        self.video_ids, self.video_index = np.unique(
+            np.array([row[0] for row in rows], dtype=object).astype(str), return_inverse=True)
+        self.seq_lo = np.array([row[1] for row in rows], dtype=np.int64)
+        self.seq_hi = np.array([row[2] for row in rows], dtype=np.int64)
+        self.scale = np.array([row[3] for row in rows], dtype=np.float32)
+
+def _load():
+    """
+    The index, reloaded when embed_db.py recorded a new matrix.
+
+    Called with _lock held. The vector database is only written by
+    embed_db.py, so its modification time tells when to look again.
+    """
+    global _index, _index_state
+    state = os.stat(VECTOR_DB_FILE).st_mtime_ns
+    if _index is None or state != _index_state:
+        conn = sqlite3.connect(VECTOR_DB_FILE)
+        try:
+            _index = _Index(conn)
+        finally:
+            conn.close()
+        _index_state = state
+        _queries.clear()
+    return _index
+
+def available():
+    """True when the packages are installed and embed_db.py has built an index."""
+    if not os.path.exists(VECTOR_DB_FILE):
+        return False
+    try:
+        import numpy
+        import sentence_transformers
+    except ImportError:
+        return False
+    return True
+
+def _query_vector(index, query):
+    global _model
+    if query in _queries:
+        _queries.move_to_end(query)
+        return _queries[query]
+    if _model is None or _model[0] != index.model_name:
+        _model = (index.model_name, embed_db.load_model(index.model_name))
+    vector = embed_db.encode(_model[1], [query], prefix=embed_db.QUERY_PREFIX)[0]
+    _queries[query] = vector
+    if len(_queries) > QUERY_CACHE_SIZE:
+        _queries.popitem(last=False)
+    return vector
+
+def search(query, video_ids=None, k=100):
+    """
+    The k windows closest in meaning to query, best first.
+
+    video_ids, if given, restricts the search to those videos. Returns
+    [(video_id, seq_lo, seq_hi, cosine similarity), ...].
+    """
+    import numpy as np
+    with _lock:
+        index = _load()
+        vector = _query_vector(index, query)
+    matrix = index.matrix
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCAN_BLOCK):
+        scores[start:start + SCAN_BLOCK] = matrix[start:start + SCAN_BLOCK].astype(np.float32) @ vector
+    scores *= index.scale
+    if video_ids is not None:
+        allowed = np.isin(index.video_ids, list(video_ids))
+        scores[~allowed[index.video_index]] = -np.inf
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(str(index.video_ids[index.video_index[i]]), int(index.seq_lo[i]), int(index.seq_hi[i]),
+             float(scores[i])) for i in top if scores[i] > -np.inf]
@@ -0,0 +1,186 @@
+"""
+WebVTT parsing shared by rebuild_db.py and 字幕データ/convert.py.
+"""
+import re
+import struct
+from itertools import accumulate
+
+# A cue: its timing line and every following non-empty line. Cue settings
+# after the end time (align:start position:0%) are skipped.
+CUE_PATTERN = re.compile(
+    r'^(\d{2}:\d{2}:\d{2}\.\d{3}) --> (\d{2}:\d{2}:\d{2}\.\d{3})[^\n]*\n?((?:[^\n]+(?:\n|\Z))*)',
+    re.MULTILINE)
+
+# Inline tags such as <00:00:00.199><c>...</c>. They never span a line.
+TAG_PATTERN = re.compile(r'<[^>\n]+>')
+
+# The timestamp tags of word-timed auto-captions: はい<00:00:00.679><c>な</c>
+# When word times are kept, every other tag is stripped up front and these
+# are taken out cue by cue.
+WORD_TIME_PATTERN = re.compile(r'<(\d{2}:\d{2}:\d{2}\.\d{3})>')
+OTHER_TAG_PATTERN = re.compile(r'<(?!\d{2}:\d{2}:\d{2}\.\d{3}>)[^>\n]+>')
+
+# Packed word timings: one little-endian uint32 per word, the character
+# offset in the caption text in the high WORD_OFFSET_BITS bits and the
+# milliseconds since the caption start in the rest. Words beyond a 4095
+# character offset are dropped and later times are clamped to ~17 minutes.
+WORD_OFFSET_BITS = 12
+WORD_DELTA_BITS = 32 - WORD_OFFSET_BITS
+
+def parse_timestamp(timestamp_str):
+    """Converts HH:MM:SS.mmm to milliseconds."""
+    try:
+        parts = timestamp_str.split(':')
+        hours = int(parts[0])
+        minutes = int(parts[1])
+        seconds = float(parts[2])
+        return (hours * 3600 + minutes * 60) * 1000 + round(seconds * 1000)
+    except ValueError:
+        return 0
+
+_minute_ms = {}
+
+def timestamp_ms(timestamp):
+    """Fast parse_timestamp() for the exact HH:MM:SS.mmm form CUE_PATTERN matches."""
+    minute = timestamp[:5]
+    base = _minute_ms.get(minute)
+    if base is None:
+        base = _minute_ms[minute] = int(minute[:2]) * 3600000 + int(minute[3:]) * 60000
+    return base + int(timestamp[6:8] + timestamp[9:12])
+
+def _timed_text(body):
+    """
+    Cleans a cue body that still has its word timestamp tags.
+
+    Returns the text as iter_raw_cues() does and the word timings as
+    [(character offset in the text, HH:MM:SS.mmm), ...]. The first word of
+    a line has no tag of its own; it starts with the cue.
+    """
+    lines = []
+    words = []
+    offset = 0
+    for line in body.split('\n'):
+        parts = WORD_TIME_PATTERN.split(line) if '<' in line else (line,)
+        if len(parts) > 1:
+            line = ''.join(parts[::2])
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if lines:
+            offset += 1
+        if len(parts) > 1:
+            # parts alternates text and timestamps; each timestamp starts
+            # the text after it, at the length of all the text before it.
+            first = max(offset - (len(line) - len(line.lstrip())) + len(parts[0]), offset)
+            words.extend(zip(accumulate(map(len, parts[2:-1:2]), initial=first), parts[1::2]))
+        lines.append(stripped)
+        offset += len(stripped)
+    return '\n'.join(lines), words
+
+def iter_raw_cues(file_path, word_times=False):
+    """
+    Yields the cues of a VTT file as (start, end, text), times as HH:MM:SS.mmm.
+
+    text holds the cue's lines with tags removed, whitespace stripped and
+    empty lines dropped, joined by newlines; it is '' for a blank cue. The
+    file is read and decoded once, tags are stripped from the whole text in
+    one regex pass, and one match per cue does the rest, instead of a regex
+    per line and per caption.
+
+    With word_times=True the cues are (start, end, text, words), words
+    being the word timings of word-timed lines (see _timed_text).
+    """
+    with open(file_path, 'rb') as f:
+        text = f.read().decode('utf-8')
+    if word_times:
+        # <c> and </c> make up most of the other tags; str.replace is cheaper.
+        text = OTHER_TAG_PATTERN.sub('', text.replace('<c>', '').replace('</c>', ''))
+    else:
+        text = TAG_PATTERN.sub('', text)
+    if '&nbsp;' in text:
+        text = text.replace('&nbsp;', ' ')
+
+    for start, end, body in CUE_PATTERN.findall(text):
+        if word_times:
+            if '<' in body:
+                yield (start, end, *_timed_text(body))
+                continue
+            words = []
+        body = body.strip()
+        if '\n' in body:
+            body = '\n'.join(filter(None, map(str.strip, body.split('\n'))))
+        yield (start, end, body, words) if word_times else (start, end, body)
+
+def iter_cues(file_path, word_times=False):
+    """Like iter_raw_cues(), with the times as (start_ms, end_ms), word times included."""
+    # Rolling captions start each cue where the previous one ended, so the
+    # end time of the last cue usually converts the next start for free.
+    previous_end = previous_end_ms = None
+    for start, end, text, *words in iter_raw_cues(file_path, word_times):
+        start_ms = previous_end_ms if start == previous_end else timestamp_ms(start)
+        previous_end, previous_end_ms = end, timestamp_ms(end)
+        if word_times:
+            yield start_ms, previous_end_ms, text, [(o, timestamp_ms(t)) for o, t in words[0]]
+        else:
+            yield start_ms, previous_end_ms, text
+
+def normalize_cues(cues):
+    """
+    Collapses YouTube's rolling auto-captions into one caption per spoken line.
+
+    Auto-captions show every line twice: first as a word-timed cue, then as
+    a 10 ms repeat cue, and the next cue carries it over as its first line
+    while the new line is being spoken:
+
+        00:00:00.080 --> 00:00:02.430   皆さん…です      (word-timed)
+        00:00:02.430 --> 00:00:02.440   皆さん…です      (repeat)
+        00:00:02.440 --> 00:00:04.950   皆さん…です      (carry-over)
+                                        ということ…      (new line)
+
+    A line is dropped when it is the last line shown by the previous cue, so
+    each line is kept once, with the start time of the cue that introduced
+    it. Repeat cues end up empty and are skipped. Manually written captions
+    have no carry-over and pass through unchanged.
+
+    Cues with word times (iter_cues(..., word_times=True)) give captions
+    of (start, text, words), the words shifted to the caption's text.
+    """
+    captions = []
+    previous_line = None
+    for start, end, text, *words in cues:
+        if not text:
+            continue
+        first, _, rest = text.partition('\n')
+        new_text = text
+        if first == previous_line:
+            new_text = rest
+            if words:
+                cut = len(first) + 1
+                words = [[(o - cut, ms) for o, ms in words[0] if o >= cut]]
+        previous_line = text.rpartition('\n')[2]
+        if new_text:
+            captions.append((start, new_text.replace('\n', ' '), *words))
+    return captions
+
+def parse_vtt(file_path, word_times=False):
+    """
+    Parses a VTT file and returns a list of (start_ms, text) tuples, or
+    (start_ms, text, [(offset, ms), ...]) with word_times=True.
+    """
+    return normalize_cues(iter_cues(file_path, word_times))
+
+def pack_word_times(start_ms, words):
+    """Packs a caption's word timings into a BLOB (see WORD_OFFSET_BITS), None if there are none."""
+    max_delta = (1 << WORD_DELTA_BITS) - 1
+    packed = [
+        offset << WORD_DELTA_BITS | min(max(ms - start_ms, 0), max_delta)
+        for offset, ms in words if 0 < offset < 1 << WORD_OFFSET_BITS
+    ]
+    return struct.pack(f'<{len(packed)}I', *packed) if packed else None
+
+def unpack_word_times(blob):
+    """[(character offset, ms since the caption start), ...] from pack_word_times()."""
+    if not blob:
+        return []
+    mask = (1 << WORD_DELTA_BITS) - 1
+    return [(v >> WORD_DELTA_BITS, v & mask) for v in struct.unpack(f'<{len(blob) // 4}I', blob)]
@@ -1,29 +1,15 @@
 import os
+import sys
 import json
-import re
 import glob
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vtt
+
 # 設定
 SOURCE_DIR = '.'
 OUTPUT_FILE = 'kunue_rii_db.jsonl'
 
-def parse_vtt_time(time_str):
-    """ VTTの時間を秒数に変換 """
-    parts = time_str.replace('.', ':').split(':')
-    try:
-        if len(parts) >= 3:
-            return int(parts[0])*3600 + int(parts[1])*60 + int(float(parts[2]))
-    except:
-        return 0
-    return 0
-
-def clean_text(text):
-    """ タグ除去・整形 """
-    text = re.sub(r'<[^>]+>', '', text)
-    text = text.replace('&nbsp;', ' ')
-    text = text.strip()
-    return text
-
 def main():
     files = glob.glob(os.path.join(SOURCE_DIR, "*.vtt"))
     print(f"フォルダ内のファイル数: {len(files)}")
@@ -32,7 +18,7 @@ def main():
     processed_video_ids = set()
     total_records = 0
     
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as out_f:
+    with open(OUTPUT_FILE, 'w', encoding='utf-8', buffering=1024 * 1024) as out_f:
         for file_path in files:
             filename = os.path.basename(file_path)
             
@@ -65,45 +51,37 @@ def main():
             # 処理済みリストに登録
             processed_video_ids.add(video_id)
 
-            # --- VTTの中身を解析 ---
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            current_start_time = None
+            # --- VTTの中身を解析（rebuild_db.py と同じパーサー） ---
             previous_text = ""  # 【重要】直前のセリフを記憶
-            
-            for line in lines:
-                line = line.strip()
-                
-                if '-->' in line:
-                    current_start_time = line.split('-->')[0].strip()
-                    continue
-                
-                if not line or line == 'WEBVTT' or line.startswith('NOTE'):
+            out_lines = []  # ファイル1本分をまとめて書き込む
+
+            for current_start_time, _, cue_text in vtt.iter_raw_cues(file_path):
+                if not cue_text:
                     continue
-                
-                text = clean_text(line)
-                
-                # --- 【重要】セリフレベルの重複チェック ---
-                # テキストがあり、かつ「直前のセリフ」と違う場合のみ保存
-                if text and current_start_time and text != previous_text:
-                    
-                    seconds = parse_vtt_time(current_start_time)
-                    
-                    record = {
-                        "date": date,
-                        "title": title,
-                        "video_id": video_id,
-                        "text": text,
-                        "timestamp": current_start_time,
-                        "url": f"https://www.youtube.com/watch?v={video_id}&t={seconds}s"
-                    }
-                    
-                    json.dump(record, out_f, ensure_ascii=False)
-                    out_f.write('\n')
-                    
-                    total_records += 1
-                    previous_text = text # 今回のセリフを「直前」として記憶
+                seconds = vtt.timestamp_ms(current_start_time) // 1000
+
+                for text in cue_text.split('\n'):
+                    if text == 'WEBVTT' or text.startswith('NOTE'):
+                        continue
+
+                    # --- 【重要】セリフレベルの重複チェック ---
+                    # 「直前のセリフ」と違う場合のみ保存
+                    if text != previous_text:
+                        record = {
+                            "date": date,
+                            "title": title,
+                            "video_id": video_id,
+                            "text": text,
+                            "timestamp": current_start_time,
+                            "url": f"https://www.youtube.com/watch?v={video_id}&t={seconds}s"
+                        }
+
+                        out_lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+
+                        total_records += 1
+                        previous_text = text # 今回のセリフを「直前」として記憶
+
+            out_f.writelines(out_lines)
 
     print("-" * 30)
     print(f"処理した動画数（ユニーク）: {len(processed_video_ids)}")